@@ -7,16 +7,22 @@ Usage (example):
   python sample_ci_healthcheck.py
 """
 from __future__ import annotations
+import functools
+import shlex
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 import sys
 import os
-from typing import Iterable
+from typing import Iterable, Optional
 
 TOOLS = ["git", "dotnet", "python"]
 ENV_VARS = ["BUILD_NUMBER", "GIT_COMMIT", "AZURE_SUBSCRIPTION_ID"]
+# Tools whose version comes from a specific executable rather than the PATH entry
+VERSION_EXECUTABLES = {"python": sys.executable}
 
 
+@functools.cache
 def is_tool_available(tool: str) -> bool:
     return shutil.which(tool) is not None
 
@@ -25,29 +31,80 @@ def check_tools(tools: Iterable[str]) -> dict[str, bool]:
     return {t: is_tool_available(t) for t in tools}
 
 
-def check_env_vars(vars: Iterable[str]) -> dict[str, bool]:
-    return {v: (os.getenv(v) is not None) for v in vars}
-
-
-def get_version(cmd: list[str]) -> str:
+def probe_tool(tool: str) -> Optional[str]:
+    """Run `<tool> --version` once: returns the first output line, or None if the tool is missing."""
+    executable = VERSION_EXECUTABLES.get(tool)
+    if executable and not is_tool_available(tool):
+        return None
     try:
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT, text=True, timeout=5)
-        return out.strip().splitlines()[0]
+        cmd = [executable or tool, "--version"]
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=5, check=False)
+    except FileNotFoundError:
+        return None
     except Exception as e:
         return f"unknown ({e})"
+    text = (out.stdout or out.stderr).strip()
+    return text.splitlines()[0] if text else "unknown"
+
+
+_MISSING = "__TOOL_MISSING__"
+_SEPARATOR = "__TOOL_PROBE_END__"
+
+
+def _probe_tools_in_one_shell(tools: list[str]) -> Optional[dict[str, Optional[str]]]:
+    """Probe every tool from a single POSIX shell; returns None when that is not possible."""
+    sh = shutil.which("sh") if os.name == "posix" else None
+    if not sh:
+        return None
+    script = "; ".join(
+        f"if command -v {shlex.quote(t)} >/dev/null 2>&1; "
+        f"then {shlex.quote(VERSION_EXECUTABLES.get(t, t))} --version 2>&1; "
+        f"else echo {_MISSING}; fi; echo {_SEPARATOR}"
+        for t in tools
+    )
+    try:
+        out = subprocess.run([sh, "-c", script], capture_output=True, text=True, timeout=5 * len(tools), check=False)
+    except Exception:
+        return None
+    chunks = out.stdout.split(f"{_SEPARATOR}\n")
+    if len(chunks) < len(tools):
+        return None
+    versions: dict[str, Optional[str]] = {}
+    for t, chunk in zip(tools, chunks):
+        text = chunk.strip()
+        if text == _MISSING:
+            versions[t] = None
+        else:
+            versions[t] = text.splitlines()[0] if text else "unknown"
+    return versions
+
+
+def probe_tools(tools: Iterable[str]) -> dict[str, Optional[str]]:
+    tools = list(tools)
+    if not tools:
+        return {}
+    # One shell process for all probes instead of one fork+exec per tool
+    versions = _probe_tools_in_one_shell(tools)
+    if versions is not None:
+        return versions
+    # Portable fallback (e.g. Windows): independent probes run side by side
+    with ThreadPoolExecutor(max_workers=len(tools)) as ex:
+        return dict(zip(tools, ex.map(probe_tool, tools)))
+
+
+def check_env_vars(vars: Iterable[str]) -> dict[str, bool]:
+    return {v: (os.getenv(v) is not None) for v in vars}
 
 
 def main(argv: list[str]) -> int:
     print("[+] Checking required tools...")
-    tool_status = check_tools(TOOLS)
-    for t, ok in tool_status.items():
-        print(f" - {t}: {'found' if ok else 'missing'}")
-    if tool_status.get("git"):
-        print(f"    git version: {get_version(['git', '--version'])}")
-    if tool_status.get("dotnet"):
-        print(f"    dotnet version: {get_version(['dotnet', '--version'])}")
-    if tool_status.get("python"):
-        print(f"    python version: {get_version([sys.executable, '--version'])}")
+    # A single `--version` call both confirms the tool exists and reports its version
+    versions = probe_tools(TOOLS)
+    tool_status = {t: v is not None for t, v in versions.items()}
+    for t, version in versions.items():
+        print(f" - {t}: {'found' if version is not None else 'missing'}")
+        if version is not None:
+            print(f"    {t} version: {version}")
 
     print("[+] Checking CI environment variables...")
     env_status = check_env_vars(ENV_VARS)
@@ -10,8 +10,13 @@ Note: This is a demo script with safe defaults and no external dependencies.
 """
 from __future__ import annotations
 import argparse
+import errno
+import mmap
+import re
+import select
 import socket
 import sys
+import time
 from pathlib import Path
 
 COMMON_PORTS = [22, 80, 443, 3389]
@@ -23,21 +28,69 @@ IOC_KEYWORDS = [
     "xss",
     "ransom",
 ]
+# All keywords folded into one case-insensitive bytes regex that can scan an mmap directly
+IOC_RE = re.compile(b"|".join(re.escape(k.encode("utf-8")) for k in IOC_KEYWORDS), re.IGNORECASE)
 
-def check_port(host: str, port: int, timeout: float = 0.5) -> bool:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+def check_port(family: int, addr: str, port: int, timeout: float = 0.5) -> bool:
+    # Blocking connect to an already-resolved address; used when a non-blocking connect cannot start
+    with socket.socket(family, socket.SOCK_STREAM) as s:
         s.settimeout(timeout)
         try:
-            s.connect((host, port))
+            s.connect((addr, port))
             return True
-        except Exception:
+        except OSError:
             return False
 
 
-def scan_common_ports(host: str) -> dict[int, bool]:
-    results: dict[int, bool] = {}
-    for p in COMMON_PORTS:
-        results[p] = check_port(host, p)
+# connect_ex results meaning "connect in progress" (10035 is WSAEWOULDBLOCK on Windows)
+_CONNECT_PENDING = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035}
+
+
+def scan_common_ports(host: str, timeout: float = 0.5) -> dict[int, bool]:
+    # Start a non-blocking connect on every port, then collect them with select: ~one timeout total
+    results: dict[int, bool] = {p: False for p in COMMON_PORTS}
+    pending: dict[socket.socket, int] = {}
+    # Resolve the host once and reuse the address for every port (a hostname would
+    # trigger a blocking DNS lookup inside each connect_ex)
+    try:
+        infos = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return results
+    family, _, _, _, sockaddr = infos[0]
+    addr = sockaddr[0]
+    try:
+        for p in COMMON_PORTS:
+            s = socket.socket(family, socket.SOCK_STREAM)
+            s.setblocking(False)
+            try:
+                rc = s.connect_ex((addr, p))
+            except OSError:
+                s.close()
+                results[p] = check_port(family, addr, p, timeout)
+                continue
+            if rc == 0:
+                results[p] = True
+                s.close()
+            elif rc in _CONNECT_PENDING:
+                pending[s] = p
+            else:
+                s.close()
+
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            socks = list(pending)
+            # Windows reports refused connects in the exceptional list
+            _, writable, failed = select.select([], socks, socks, remaining)
+            for s in set(writable) | set(failed):
+                p = pending.pop(s)
+                results[p] = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0 and s not in failed
+                s.close()
+    finally:
+        for s in pending:
+            s.close()
     return results
 
 
@@ -46,11 +99,24 @@ def search_log_for_iocs(log_path: Path) -> list[str]:
     if not log_path.exists():
         return hits
     try:
-        with log_path.open("r", encoding="utf-8", errors="ignore") as f:
-            for i, line in enumerate(f, start=1):
-                lower = line.lower()
-                if any(ind.lower() in lower for ind in IOC_KEYWORDS):
-                    hits.append(f"Line {i}: {line.strip()}")
+        if log_path.stat().st_size == 0:
+            return hits
+        # mmap the file so the regex scans the whole buffer instead of a Python loop per line
+        with log_path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            line_no = 1
+            counted_to = 0
+            m = IOC_RE.search(mm)
+            while m:
+                start = mm.rfind(b"\n", 0, m.start()) + 1
+                end = mm.find(b"\n", m.end())
+                if end == -1:
+                    end = len(mm)
+                line_no += mm[counted_to:start].count(b"\n")
+                counted_to = start
+                line = mm[start:end].decode("utf-8", errors="ignore")
+                hits.append(f"Line {line_no}: {line.strip()}")
+                # Report each line once; resume searching on the next line
+                m = IOC_RE.search(mm, end + 1)
     except Exception as e:
         hits.append(f"Error reading log: {e}")
     return hits
@@ -18,6 +18,9 @@ from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
 from azure.ai.agents.models import ListSortOrder
 
+TERMINAL_RUN_STATUSES = ("completed", "failed", "cancelled", "expired")
+RUN_TIMEOUT_SEC = 120
+
 
 def _extract_text(content) -> str:
     """盡可能將訊息內容轉為純文字。"""
@@ -83,13 +86,15 @@ def main() -> None:
                 # 新增使用者訊息
                 agents_client.messages.create(thread_id=thread.id, role="user", content=user_input)
 
-                # 建立 run 並輪詢完成狀態
+                # 建立 run 並輪詢完成狀態：間隔自 0.1 秒起指數成長至 2 秒，
+                # 短回覆不必等滿固定 2 秒；總等待上限維持約 2 分鐘
                 run = agents_client.runs.create(thread_id=thread.id, agent_id=agent.id)
-                for _ in range(60):
+                delay = 0.1
+                deadline = time.monotonic() + RUN_TIMEOUT_SEC
+                while run.status not in TERMINAL_RUN_STATUSES and time.monotonic() < deadline:
+                    time.sleep(delay)
+                    delay = min(delay * 1.7, 2.0)
                     run = agents_client.runs.get(thread_id=thread.id, run_id=run.id)
-                    if run.status in ("completed", "failed", "cancelled", "expired"):
-                        break
-                    time.sleep(2)
 
                 # 取得訊息並印出最後的助理回覆
                 msgs = agents_client.messages.list(thread_id=thread.id, order=ListSortOrder.ASCENDING)
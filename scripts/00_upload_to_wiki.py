@@ -19,16 +19,27 @@ r"""
 """
 from __future__ import annotations
 import base64
+import functools
+import hashlib
+import itertools
+import json
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 import requests
 from dotenv import load_dotenv
 
+from _common import build_session, load_json_state, save_json_state
+
 API_VERSION = "7.2-preview"
 
+# 子頁面上傳的預設並行數（工作負載以網路延遲為主）；可用 AZDO_CONCURRENCY 調整
+UPLOAD_WORKERS = 16
+
 SUPPORTED_TEXT_EXTS = {".md", ".txt"}
 CODE_BLOCK_EXTS = {
     ".py": "python",
@@ -49,15 +60,22 @@ def env(name: str, default: Optional[str] = None) -> Optional[str]:
     return v if v else default
 
 
-def get_auth_header(pat: str) -> dict[str, str]:
+@functools.cache
+def _basic_auth_value(pat: str) -> str:
+    # 同一 PAT 只需編碼一次
     token = base64.b64encode(f":{pat}".encode("utf-8")).decode("utf-8")
-    return {"Authorization": f"Basic {token}"}
+    return f"Basic {token}"
+
+
+def get_auth_header(pat: str) -> dict[str, str]:
+    # 每次回傳新的 dict，呼叫端修改也不會影響其他請求
+    return {"Authorization": _basic_auth_value(pat)}
 
 
-def ensure_wiki(org_url: str, project: str, wiki_name: str, headers: dict) -> dict:
+def ensure_wiki(session: requests.Session, org_url: str, project: str, wiki_name: str, headers: dict) -> dict:
     # 列出現有的 wikis
     list_url = f"{org_url}/{project}/_apis/wiki/wikis"
-    r = requests.get(list_url, headers=headers, params={"api-version": API_VERSION}, timeout=30)
+    r = session.get(list_url, headers=headers, params={"api-version": API_VERSION}, timeout=30)
     if not r.ok:
         print(f"[Azure DevOps] List wikis failed: {r.status_code} {r.reason} -> {list_url}")
         try:
@@ -72,50 +90,83 @@ def ensure_wiki(org_url: str, project: str, wiki_name: str, headers: dict) -> di
     # 若不存在則建立 project wiki（類型為 ProjectWiki）
     create_url = f"{org_url}/{project}/_apis/wiki/wikis"
     payload = {"name": wiki_name, "type": "projectWiki"}
-    r = requests.post(create_url, headers=headers, params={"api-version": API_VERSION}, json=payload, timeout=30)
+    r = session.post(create_url, headers=headers, params={"api-version": API_VERSION}, json=payload, timeout=30)
     if r.status_code not in (200, 201):
         r.raise_for_status()
     return r.json()
 
 
-def get_page(org_url: str, project: str, wiki_id: str, path: str, headers: dict) -> tuple[int, Optional[str]]:
+def content_sha256(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_page(
+    session: requests.Session,
+    org_url: str,
+    project: str,
+    wiki_id: str,
+    path: str,
+    headers: dict,
+    include_content: bool = False,
+) -> tuple[int, Optional[str], Optional[str]]:
+    """回傳 (HTTP 狀態, ETag, 內容 SHA-256)；僅在 include_content=True 且頁面存在時計算雜湊。"""
     url = f"{org_url}/{project}/_apis/wiki/wikis/{wiki_id}/pages"
-    r = requests.get(
+    r = session.get(
         url,
         headers=headers,
-        params={"path": path, "includeContent": "false", "api-version": API_VERSION},
+        params={"path": path, "includeContent": "true" if include_content else "false", "api-version": API_VERSION},
         timeout=30,
     )
     if r.status_code == 200:
-        return 200, r.headers.get("ETag")
-    return r.status_code, None
-
-
-def create_or_update_page(org_url: str, project: str, wiki_id: str, path: str, content: str, headers: dict, etag: Optional[str]) -> None:
+        remote_sha = None
+        if include_content:
+            try:
+                remote = r.json().get("content")
+            except Exception:
+                remote = None
+            if isinstance(remote, str):
+                remote_sha = content_sha256(remote)
+        return 200, r.headers.get("ETag"), remote_sha
+    return r.status_code, None, None
+
+
+def create_or_update_page(
+    session: requests.Session,
+    org_url: str,
+    project: str,
+    wiki_id: str,
+    path: str,
+    content: str,
+    headers: dict,
+    etag: Optional[str],
+) -> None:
     url = f"{org_url}/{project}/_apis/wiki/wikis/{wiki_id}/pages"
-    req_headers = {**headers, "Content-Type": "application/json"}
+    req_headers = {**headers, "Content-Type": "application/json; charset=utf-8"}
     params = {"path": path, "api-version": API_VERSION}
-    payload = {"content": content}
+    # 只序列化一次（重試時沿用）；非 ASCII 字元直接以 UTF-8 傳送，
+    # 不用 json= 預設的 \uXXXX 跳脫（中文內容的 payload 約可縮小一半）
+    body = json.dumps({"content": content}, ensure_ascii=False).encode("utf-8")
 
     if etag:
         req_headers["If-Match"] = etag
-        r = requests.patch(url, headers=req_headers, params=params, json=payload, timeout=30)
+        r = session.patch(url, headers=req_headers, params=params, data=body, timeout=30)
     else:
-        r = requests.put(url, headers=req_headers, params=params, json=payload, timeout=30)
+        r = session.put(url, headers=req_headers, params=params, data=body, timeout=30)
 
     if r.status_code not in (200, 201):
         if r.status_code == 409 and not etag:
-            status, new_etag = get_page(org_url, project, wiki_id, path, headers)
+            status, new_etag, _ = get_page(session, org_url, project, wiki_id, path, headers)
             if status == 200 and new_etag:
                 req_headers["If-Match"] = new_etag
-                r = requests.patch(url, headers=req_headers, params=params, json=payload, timeout=30)
+                r = session.patch(url, headers=req_headers, params=params, data=body, timeout=30)
         r.raise_for_status()
 
 
 def file_to_markdown(path: Path) -> str:
     ext = path.suffix.lower()
     try:
-        text = path.read_text(encoding="utf-8")
+        # 一次讀入 bytes 再整段解碼，避免 TextIOWrapper 逐段解碼；換行比照 read_text 統一為 \n
+        text = path.read_bytes().decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
     except Exception:
         # 無法讀取（可能為二進位或權限不足）時改以提示文字回傳
         return f"> Unable to display file `{path.name}` (binary or unreadable)"
@@ -135,31 +186,92 @@ def make_page_path(folder_name: str, relative_file: Optional[Path] = None) -> st
     return f"{folder_name}/{stem}"
 
 
-def upload_folder(org_url: str, project: str, wiki: dict, folder: Path, headers: dict) -> None:
+def _display_name(path: Path) -> str:
+    return path.stem if path.suffix.lower() in SUPPORTED_TEXT_EXTS else path.name
+
+
+_CACHE_LOCK = threading.Lock()
+
+
+def _upload_one(
+    session: requests.Session,
+    org_url: str,
+    project: str,
+    wiki_id: str,
+    page_path: str,
+    content: str,
+    headers: dict,
+    cache: Optional[dict] = None,
+    stat_key: Optional[str] = None,
+) -> bool:
+    """上傳單一頁面；若內容與上次成功上傳時或 Wiki 上現有內容相同則略過。回傳是否實際送出寫入。"""
+    sha = content_sha256(content)
+    if cache is not None:
+        with _CACHE_LOCK:
+            entry = cache.get(page_path)
+            if entry and entry.get("sha256") == sha:
+                # 檔案僅被觸碰（mtime 改變）但內容未變：更新 stat 以便下次直接略過
+                entry["stat"] = stat_key
+                return False
+
+    # 取得 ETag 時一併取回現有內容：與本機內容相同就不必 PUT/PATCH
+    status, etag, remote_sha = get_page(session, org_url, project, wiki_id, page_path, headers, include_content=True)
+    written = not (status == 200 and remote_sha == sha)
+    if written:
+        create_or_update_page(session, org_url, project, wiki_id, page_path, content, headers, etag if status == 200 else None)
+
+    if cache is not None:
+        with _CACHE_LOCK:
+            cache[page_path] = {"stat": stat_key, "sha256": sha}
+    return written
+
+
+def upload_folder(
+    session: requests.Session,
+    org_url: str,
+    project: str,
+    wiki: dict,
+    folder: Path,
+    headers: dict,
+    cache: Optional[dict] = None,
+    workers: int = UPLOAD_WORKERS,
+) -> None:
     wiki_id = wiki["id"]
     folder_name = folder.name
+    files = [p for p in sorted(folder.glob("*")) if p.is_file()]
 
     # 建立/更新此資料夾對應的頂層頁面，並包含索引
     page_path = make_page_path(folder_name)
-    lines = [f"# {folder_name}", "", "Sub-pages:"]
-    for p in sorted(folder.glob("*")):
-        if p.is_file():
-            sub_page_path = make_page_path(folder_name, p.relative_to(folder))
-            display = p.stem if p.suffix.lower() in SUPPORTED_TEXT_EXTS else p.name
-            lines.append(f"- [{display}]({sub_page_path})")
-    index_md = "\n".join(lines)
-
-    status, etag = get_page(org_url, project, wiki_id, page_path, headers)
-    create_or_update_page(org_url, project, wiki_id, page_path, index_md, headers, etag if status == 200 else None)
-
-    # 將資料夾內每個檔案上傳為子頁面
-    for p in sorted(folder.glob("*")):
-        if not p.is_file():
-            continue
+    index_md = "\n".join(
+        itertools.chain(
+            (f"# {folder_name}", "", "Sub-pages:"),
+            (f"- [{_display_name(p)}]({make_page_path(folder_name, p.relative_to(folder))})" for p in files),
+        )
+    )
+
+    # 頂層頁面須先存在，子頁面才能建立於其下
+    written = int(_upload_one(session, org_url, project, wiki_id, page_path, index_md, headers, cache))
+
+    # 檔案的 mtime 與大小皆未變時，連讀檔都省略；其餘才轉成 Markdown 交給執行緒池
+    tasks: list[tuple[str, str, str]] = []
+    for p in files:
         sub_page_path = make_page_path(folder_name, p.relative_to(folder))
-        content = file_to_markdown(p)
-        status, etag = get_page(org_url, project, wiki_id, sub_page_path, headers)
-        create_or_update_page(org_url, project, wiki_id, sub_page_path, content, headers, etag if status == 200 else None)
+        st = p.stat()
+        stat_key = f"{st.st_mtime_ns}:{st.st_size}"
+        entry = cache.get(sub_page_path) if cache is not None else None
+        if entry and entry.get("stat") == stat_key:
+            continue
+        tasks.append((sub_page_path, file_to_markdown(p), stat_key))
+
+    # 將資料夾內每個檔案上傳為子頁面（各頁面互相獨立，以執行緒並行送出）
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        written += sum(
+            ex.map(lambda t: _upload_one(session, org_url, project, wiki_id, t[0], t[1], headers, cache, t[2]), tasks)
+        )
+
+    skipped = len(files) + 1 - written
+    if skipped:
+        print(f"[i] Skipped {skipped} unchanged page(s) in {folder_name}")
 
 
 def main(argv: list[str]) -> int:
@@ -181,22 +293,41 @@ def main(argv: list[str]) -> int:
         print("ERROR: Set AZDO_PAT environment variable with a valid Personal Access Token")
         return 2
 
+    try:
+        workers = max(1, int(env("AZDO_CONCURRENCY") or UPLOAD_WORKERS))
+    except ValueError:
+        print("ERROR: AZDO_CONCURRENCY must be an integer")
+        return 2
+
     headers = {"Accept": "application/json"}
     headers.update(get_auth_header(pat))
 
-    wiki = ensure_wiki(org_url.rstrip("/"), project, wiki_name, headers)
+    # 共用單一 Session，所有請求都打向同一個 Azure DevOps 主機：連線數上限等於執行緒數
+    session = build_session(pool_maxsize=workers, retries=False)
+
+    wiki = ensure_wiki(session, org_url.rstrip("/"), project, wiki_name, headers)
 
     root = Path(root_str)
     if not root.exists():
         print(f"ERROR: Root folder not found: {root}")
         return 2
 
+    # 上傳紀錄：預設存放於 .cache/wiki_upload/<wiki id>.json；UPLOAD_CACHE=false 可停用
+    use_cache = (env("UPLOAD_CACHE") or "true").strip().lower() not in {"0", "false", "no", "off"}
+    cache_path = Path(env("UPLOAD_CACHE_DIR") or (repo_root / ".cache" / "wiki_upload")) / f"{wiki['id']}.json"
+    cache = load_json_state(cache_path) if use_cache else None
+
     # 僅處理以下子資料夾
     wanted = {"Networking", "Security", "DevOps"}
-    for sf in sorted([p for p in root.iterdir() if p.is_dir()], key=lambda p: p.name):
-        if sf.name in wanted:
-            print(f"[+] Uploading folder: {sf}")
-            upload_folder(org_url.rstrip("/"), project, wiki, sf, headers)
+    try:
+        for sf in sorted([p for p in root.iterdir() if p.is_dir()], key=lambda p: p.name):
+            if sf.name in wanted:
+                print(f"[+] Uploading folder: {sf}")
+                upload_folder(session, org_url.rstrip("/"), project, wiki, sf, headers, cache, workers)
+    finally:
+        # 即使中途失敗，也保留已成功上傳的頁面紀錄
+        if cache is not None:
+            save_json_state(cache_path, cache)
 
     print("[+] Done.")
     return 0
@@ -21,25 +21,39 @@ r"""
 from __future__ import annotations
 
 import base64
+import functools
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterable, Optional
 
 import requests
 from dotenv import load_dotenv
 
+from _common import build_session
+
 API_VERSION = "7.2-preview"
 
+# 頁面內容下載的預設並行數（工作負載以網路延遲為主）；可用 AZDO_CONCURRENCY 調整
+DOWNLOAD_WORKERS = 16
+
 
 def env(name: str, default: Optional[str] = None) -> Optional[str]:
     v = os.getenv(name)
     return v if v else default
 
 
-def get_auth_header(pat: str) -> dict[str, str]:
+@functools.cache
+def _basic_auth_value(pat: str) -> str:
+    # 同一 PAT 只需編碼一次
     token = base64.b64encode(f":{pat}".encode("utf-8")).decode("utf-8")
-    return {"Authorization": f"Basic {token}"}
+    return f"Basic {token}"
+
+
+def get_auth_header(pat: str) -> dict[str, str]:
+    # 每次回傳新的 dict，呼叫端修改也不會影響其他請求
+    return {"Authorization": _basic_auth_value(pat)}
 
 
 def sanitize_segment(name: str) -> str:
@@ -54,9 +68,9 @@ def ensure_output_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 
-def find_wiki(org_url: str, project: str, wiki_name: Optional[str], headers: dict) -> Optional[dict]:
+def find_wiki(session: requests.Session, org_url: str, project: str, wiki_name: Optional[str], headers: dict) -> Optional[dict]:
     url = f"{org_url}/{project}/_apis/wiki/wikis"
-    r = requests.get(url, headers=headers, params={"api-version": API_VERSION}, timeout=30)
+    r = session.get(url, headers=headers, params={"api-version": API_VERSION}, timeout=30)
     if not r.ok:
         try:
             details = r.json()
@@ -77,13 +91,16 @@ def find_wiki(org_url: str, project: str, wiki_name: Optional[str], headers: dic
     return wikis[0] if wikis else None
 
 
-def list_all_paths(org_url: str, project: str, wiki_id: str, headers: dict) -> Iterable[str]:
+def list_all_pages(
+    session: requests.Session, org_url: str, project: str, wiki_id: str, headers: dict
+) -> Iterable[tuple[str, Optional[str]]]:
     """
-    使用 recursionLevel=Full 取得所有頁面的路徑，回傳可迭代的頁面路徑集合。
+    使用 recursionLevel=Full 與 includeContent=true 一次取得所有頁面，回傳 (頁面路徑, 內容) 的可迭代集合。
+    若回應中某頁面未附內容，內容為 None，由呼叫端再個別下載。
     """
     url = f"{org_url}/{project}/_apis/wiki/wikis/{wiki_id}/pages"
-    params = {"recursionLevel": "Full", "api-version": API_VERSION}
-    r = requests.get(url, headers=headers, params=params, timeout=60)
+    params = {"recursionLevel": "Full", "includeContent": "true", "api-version": API_VERSION}
+    r = session.get(url, headers=headers, params=params, timeout=60)
     if not r.ok:
         try:
             details = r.json()
@@ -92,20 +109,25 @@ def list_all_paths(org_url: str, project: str, wiki_id: str, headers: dict) -> I
         raise RuntimeError(f"List pages failed: {r.status_code} {r.reason} -> {details}")
 
     data = r.json() or {}
+
+    def entry(node: dict):
+        content = node.get("content")
+        return node.get("path"), (content if isinstance(content, str) else None)
+
     # 支援兩種回傳結構：'value' 底下的清單，或含 'subPages' 的樹狀節點
     value = data.get("value")
     if isinstance(value, list):
         for item in value:
-            p = item.get("path")
+            p, content = entry(item)
             if isinstance(p, str):
-                yield p
+                yield p, content
         return
 
     # 樹狀結構
     def walk(node: dict):
-        p = node.get("path")
+        p, content = entry(node)
         if isinstance(p, str):
-            yield p
+            yield p, content
         for child in node.get("subPages", []) or []:
             if isinstance(child, dict):
                 yield from walk(child)
@@ -113,10 +135,10 @@ def list_all_paths(org_url: str, project: str, wiki_id: str, headers: dict) -> I
     yield from walk(data)
 
 
-def get_page_content(org_url: str, project: str, wiki_id: str, path: str, headers: dict) -> Optional[str]:
+def get_page_content(session: requests.Session, org_url: str, project: str, wiki_id: str, path: str, headers: dict) -> Optional[str]:
     url = f"{org_url}/{project}/_apis/wiki/wikis/{wiki_id}/pages"
     params = {"path": path, "includeContent": "true", "api-version": API_VERSION}
-    r = requests.get(url, headers=headers, params=params, timeout=60)
+    r = session.get(url, headers=headers, params=params, timeout=60)
     if r.status_code == 200:
         try:
             return r.json().get("content")
@@ -140,8 +162,16 @@ def path_to_local_file(output_root: Path, wiki_path: str) -> Path:
     return output_root.joinpath(*dirs) / f"{leaf}.md"
 
 
-def export_wiki(org_url: str, project: str, wiki_name: Optional[str], output_dir: Path, headers: dict) -> int:
-    wiki = find_wiki(org_url, project, wiki_name, headers)
+def export_wiki(
+    session: requests.Session,
+    org_url: str,
+    project: str,
+    wiki_name: Optional[str],
+    output_dir: Path,
+    headers: dict,
+    workers: int = DOWNLOAD_WORKERS,
+) -> int:
+    wiki = find_wiki(session, org_url, project, wiki_name, headers)
     if not wiki:
         print(f"ERROR: Wiki not found. Name={wiki_name!r}")
         return 2
@@ -153,59 +183,73 @@ def export_wiki(org_url: str, project: str, wiki_name: Optional[str], output_dir
 
     ensure_output_dir(output_dir)
 
-    paths = list(dict.fromkeys(list_all_paths(org_url, project, wiki_id, headers)))  # 去重且保留順序
+    # 去重且保留順序（同一路徑以第一次出現者為準）
+    pages: dict[str, Optional[str]] = {}
+    for p, content in list_all_pages(session, org_url, project, wiki_id, headers):
+        pages.setdefault(p, content)
+    paths = list(pages)
     if not paths:
         print("[i] No pages found to export.")
         return 0
 
     # 判斷容器頁面：若某路徑為其他路徑的前綴且後面接 '/'，則視為容器
+    # 先收集所有路徑的上層路徑（每條路徑只切分一次），避免兩兩比對前綴的 O(N²) 成本
     norm_paths = [p.strip().rstrip('/') for p in paths]
-    path_set = set(norm_paths)
-    containers: set[str] = set()
+    parents: set[str] = set()
     for p in norm_paths:
-        prefix = p + '/'
-        for q in norm_paths:
-            if q != p and q.startswith(prefix):
-                containers.add(p)
-                break
-
-    exported = 0
-    created_dirs = 0
+        segs = p.split('/')
+        for i in range(1, len(segs)):
+            parents.add('/'.join(segs[:i]))
+    containers = {p for p in norm_paths if p in parents}
+
+    tasks: list[tuple[str, list[str], bool, Optional[str]]] = []
     for p in paths:
         p_norm = p.strip().rstrip('/')
         parts = [seg for seg in p_norm.split('/') if seg]
         if not parts:
             parts = ["Home"]
         safe_parts = [sanitize_segment(seg) for seg in parts]
-
-        is_container = p_norm in containers
-        if is_container:
-            # 依頁面路徑建立對應的資料夾
-            dir_path = output_dir.joinpath(*safe_parts)
-            dir_path.mkdir(parents=True, exist_ok=True)
-            created_dirs += 1
-            # 若容器頁面仍有內容，則以 index.md 儲存
-            content = get_page_content(org_url, project, wiki_id, (p_norm or "/"), headers)
-            if content is not None and content != "":
-                index_file = dir_path / "index.md"
-                index_file.write_text(content, encoding="utf-8")
-                exported += 1
-                print(f"[+] Exported: {p_norm} -> {index_file}")
+        tasks.append((p_norm, safe_parts, p_norm in containers, pages[p]))
+
+    def fetch(t: tuple[str, list[str], bool, Optional[str]]) -> Optional[str]:
+        # 清單回應已附內容者直接使用；缺少內容時才另外 GET 該頁面
+        p_norm, _, _, inline = t
+        if inline is not None:
+            return inline
+        return get_page_content(session, org_url, project, wiki_id, (p_norm or "/"), headers)
+
+    # 各頁面內容互相獨立：以執行緒池並行下載（ex.map 保留原順序），寫檔仍在主執行緒依序進行
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        contents = ex.map(fetch, tasks)
+
+        exported = 0
+        created_dirs = 0
+        for (p_norm, safe_parts, is_container, _), content in zip(tasks, contents):
+            if is_container:
+                # 依頁面路徑建立對應的資料夾
+                dir_path = output_dir.joinpath(*safe_parts)
+                dir_path.mkdir(parents=True, exist_ok=True)
+                created_dirs += 1
+                # 若容器頁面仍有內容，則以 index.md 儲存
+                if content is not None and content != "":
+                    index_file = dir_path / "index.md"
+                    index_file.write_text(content, encoding="utf-8")
+                    exported += 1
+                    print(f"[+] Exported: {p_norm} -> {index_file}")
+                else:
+                    print(f"[i] Created folder for container page: {p_norm} -> {dir_path}")
             else:
-                print(f"[i] Created folder for container page: {p_norm} -> {dir_path}")
-        else:
-            # 葉節點頁面：直接寫成上層目錄下的 .md 檔
-            parent_dir = output_dir if len(safe_parts) == 1 else output_dir.joinpath(*safe_parts[:-1])
-            parent_dir.mkdir(parents=True, exist_ok=True)
-            content = get_page_content(org_url, project, wiki_id, (p_norm or "/"), headers)
-            if content is None:
-                # 無內容 — 略過檔案但仍確保目錄存在
-                print(f"[i] Skipped empty leaf: {p_norm}")
-                continue
-            leaf_file = parent_dir / f"{safe_parts[-1]}.md"
-            leaf_file.write_text(content, encoding="utf-8")
-            exported += 1
-            print(f"[+] Exported: {p_norm} -> {leaf_file}")
+                # 葉節點頁面：直接寫成上層目錄下的 .md 檔
+                parent_dir = output_dir if len(safe_parts) == 1 else output_dir.joinpath(*safe_parts[:-1])
+                parent_dir.mkdir(parents=True, exist_ok=True)
+                if content is None:
+                    # 無內容 — 略過檔案但仍確保目錄存在
+                    print(f"[i] Skipped empty leaf: {p_norm}")
+                    continue
+                leaf_file = parent_dir / f"{safe_parts[-1]}.md"
+                leaf_file.write_text(content, encoding="utf-8")
+                exported += 1
+                print(f"[+] Exported: {p_norm} -> {leaf_file}")
 
     print(f"[+] Done. Exported {exported} page(s) and created {created_dirs} folder(s) at {output_dir}")
     return 0
@@ -230,11 +274,20 @@ def main(argv: list[str]) -> int:
         print("ERROR: Set AZDO_PAT environment variable with a valid Personal Access Token")
         return 2
 
+    try:
+        workers = max(1, int(env("AZDO_CONCURRENCY") or DOWNLOAD_WORKERS))
+    except ValueError:
+        print("ERROR: AZDO_CONCURRENCY must be an integer")
+        return 2
+
     headers = {"Accept": "application/json"}
     headers.update(get_auth_header(pat))
 
+    # 共用單一 Session，所有請求都打向同一個 Azure DevOps 主機：連線數上限等於執行緒數
+    session = build_session(pool_maxsize=workers, retries=False)
+
     try:
-        return export_wiki(org_url, project, wiki_name, output_dir, headers)
+        return export_wiki(session, org_url, project, wiki_name, output_dir, headers, workers)
     except Exception as ex:
         print(f"ERROR: {ex}")
         return 1
@@ -19,8 +19,12 @@ import json
 import os
 import re
 from pathlib import Path
-from typing import Literal
+from typing import Iterable, Iterator, Literal
 
+try:
+    import orjson  # 選用：以 Rust 實作的 JSON 編碼器，直接輸出 UTF-8 bytes
+except ImportError:
+    orjson = None
 
 RepoRoot = Path(__file__).resolve().parents[1]
 WIKI_DIR = RepoRoot / "wiki-export"
@@ -54,33 +58,44 @@ def infer_category(path: Path, content: str) -> Category:
     return "DevOps"  # type: ignore[return-value]
 
 
-def infer_type(file_name: str, content: str) -> Type:
-    base = file_name.lower()
-    if "meeting-notes" in base or "meeting_notes" in base:
-        return "meeting_notes"
-    if base.startswith("knowledge") or "knowledge-" in base:
-        return "knowledge"
-    if "credentials" in base:
-        return "credentials"
+# 依序對應原本的判斷優先順序：每個分支以 lookahead 自字首檢查，
+# re.match 會依序嘗試分支，第一個成立者的群組名稱（lastgroup）即為類型
+_TYPE_RE = re.compile(
+    r"(?:(?=.*meeting[-_]notes)(?P<meeting_notes>)"
+    r"|(?=knowledge|.*knowledge-)(?P<knowledge>)"
+    r"|(?=.*credentials)(?P<credentials>)"
     # 類程式碼檔（例如 sample.py.md、script.ps1.md）
-    if re.search(r"\.(py|ps1|sh|js|ts|yaml|yml|json|xml|cs)\.md$", base):
-        return "code"
-    if base == "index.md":
-        return "others"
-    return "others"
+    r"|(?=.*\.(?:py|ps1|sh|js|ts|yaml|yml|json|xml|cs)\.md$)(?P<code>))",
+    re.DOTALL,
+)
 
 
-def collect_md_files(root: Path) -> list[Path]:
-    return sorted([p for p in root.rglob("*.md") if p.is_file()])
+def infer_type(file_name: str, content: str) -> Type:
+    m = _TYPE_RE.match(file_name.lower())
+    if m:
+        return m.lastgroup  # type: ignore[return-value]
+    return "others"
 
 
-def main() -> int:
-    if not WIKI_DIR.exists():
-        print(f"ERROR: Input folder not found: {WIKI_DIR}")
-        return 2
-
-    files = collect_md_files(WIKI_DIR)
-    items = []
+def collect_md_files(root: Path) -> list[Path]:
+    # 以 os.scandir 走訪：DirEntry 會快取目錄讀取時得到的型別資訊，省去逐檔 stat
+    out: list[Path] = []
+    stack = [str(root)]
+    while stack:
+        d = stack.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                # normcase：與 rglob 相同，在 Windows 上副檔名比對不分大小寫
+                elif os.path.normcase(e.name).endswith(".md") and e.is_file(follow_symlinks=False):
+                    out.append(Path(e.path))
+    out.sort()
+    return out
+
+
+def iter_items(files: list[Path]) -> Iterator[dict]:
+    """依序讀取檔案並產生 items 元素（一次只保留一個檔案的內容在記憶體中）。"""
     i = 0
     for fp in files:
     # 排除 Home.md 與 index.md
@@ -88,30 +103,62 @@ def main() -> int:
             continue
         i += 1
         try:
-            content = fp.read_text(encoding="utf-8")
+            # 一次讀入 bytes 再整段解碼；換行比照 read_text 統一為 \n
+            content = fp.read_bytes().decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
         except Exception:
             content = ""
 
         cat = infer_category(fp, content)
         t = infer_type(fp.name, content)
-        items.append(
-            {
-                "id": str(i),
-                "file_name": fp.name,
-                "category": cat,
-                "type": t,
-                "content": content,
-            }
-        )
+        yield {
+            "id": str(i),
+            "file_name": fp.name,
+            "category": cat,
+            "type": t,
+            "content": content,
+        }
+
+
+def _dumps_item(item: dict) -> bytes:
+    """以 indent=2 序列化單一 item 為 UTF-8 bytes；有 orjson 時優先使用。"""
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_INDENT_2)
+    return json.dumps(item, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def write_items_json(out, items: Iterable[dict]) -> Iterator[dict]:
+    """將 items 逐筆寫出為 {"items": [...]}（out 為二進位檔案），輸出與 json.dumps(..., indent=2) 相同。
+
+    每筆寫出後再 yield 給呼叫端（方便統計），不需先把全部 items 與整份 JSON 字串留在記憶體中。
+    """
+    out.write(b'{\n  "items": [')
+    first = True
+    for item in items:
+        out.write(b"\n    " if first else b",\n    ")
+        # 字串內的換行已被跳脫，逐行縮排不會影響內容
+        out.write(_dumps_item(item).replace(b"\n", b"\n    "))
+        first = False
+        yield item
+    out.write(b"]\n}" if first else b"\n  ]\n}")
+
+
+def main() -> int:
+    if not WIKI_DIR.exists():
+        print(f"ERROR: Input folder not found: {WIKI_DIR}")
+        return 2
+
+    files = collect_md_files(WIKI_DIR)
 
     # Ensure output directory exists
     OUTPUT_JSON.parent.mkdir(parents=True, exist_ok=True)
-    OUTPUT_JSON.write_text(json.dumps({"items": items}, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"[+] Wrote {len(items)} items to {OUTPUT_JSON}")
-    # Show a brief breakdown
+    count = 0
     by_cat = {"Networking": 0, "Security": 0, "DevOps": 0}
-    for it in items:
-        by_cat[it["category"]] += 1
+    with OUTPUT_JSON.open("wb") as out:
+        for it in write_items_json(out, iter_items(files)):
+            count += 1
+            by_cat[it["category"]] += 1
+    print(f"[+] Wrote {count} items to {OUTPUT_JSON}")
+    # Show a brief breakdown
     print("[i] Counts by category:", by_cat)
     return 0
 
@@ -15,6 +15,8 @@
     INDEX_NAME               索引名稱（預設：it-knowledge-index）
     API_VERSION              API 版本（預設：2023-11-01）
     EMBEDDING_DIMENSIONS     向量維度（預設：1536）
+    UPLOAD_MANIFEST          是否略過內容未變更的文件（預設：true；紀錄存於 .cache/search_upload/）
+    INDEX_STATE              --overwrite 時若結構未變更則略過 PUT（預設：true；紀錄存於 .cache/search_index/）
 
 使用範例（PowerShell）：
     # 建立（POST）。若索引已存在則失敗
@@ -34,21 +36,53 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import gzip
+import hashlib
 import json
+import mmap
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 import requests
 from dotenv import load_dotenv
 
+from _common import (
+    build_adapter,
+    build_session,
+    json_dumps,
+    json_loads,
+    load_json_state,
+    orjson,
+    save_json_state,
+)
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+_SESSION = build_session()
+
 
 # --- Env helpers -------------------------------------------------------------
+# 環境變數前後需去除的空白與引號（.env 中的值可能帶引號）
+_ENV_STRIP_CHARS = " \t\r\n\"'"
+
+
+# 參數解析時已先呼叫 load_dotenv()，之後環境變數不再變動，可安全快取
+@functools.cache
 def _env_value(name: str, default: Optional[str] = None) -> Optional[str]:
     """Get an env var and trim surrounding quotes/whitespace; return default if missing."""
     v = os.getenv(name)
     if v is None:
         return default
-    v = v.strip().strip('"').strip("'")
+    v = v.strip(_ENV_STRIP_CHARS)
     return v if v != "" else default
 
 
@@ -149,6 +183,15 @@ def build_index_schema(index_name: str, embedding_dimensions: int) -> Dict[str,
     }
 
 
+def _schema_hash(body: Dict[str, Any]) -> str:
+    """以排序鍵後的 JSON 計算 schema 的穩定雜湊。"""
+    if orjson is not None:
+        data = orjson.dumps(body, option=orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
 def create_or_update_index(
     service_name: str,
     api_key: str,
@@ -156,98 +199,431 @@ def create_or_update_index(
     index_name: str,
     embedding_dimensions: int,
     overwrite: bool,
-) -> requests.Response:
+    state_path: Optional[Path] = None,
+) -> Tuple[requests.Response, bool]:
+    """建立（POST）或更新（PUT）索引，回傳 (回應, 是否因結構未變更而略過)。
+
+    提供 state_path 且為 --overwrite 時，會先 GET 索引取得 ETag：若 ETag 與本機 schema 雜湊
+    皆與上次成功寫入時相同則略過 PUT；否則以 If-Match 送出 PUT，避免覆蓋他人同時的變更。
+    """
     base_url = f"https://{service_name}.search.windows.net"
     headers = {
         "Content-Type": "application/json",
         "api-key": api_key,
     }
     body = build_index_schema(index_name, embedding_dimensions)
+    schema_hash = _schema_hash(body)
     if overwrite:
         # PUT /indexes('{indexName}') 進行建立或更新
         url = f"{base_url}/indexes('{index_name}')?api-version={api_version}"
-        method = requests.put
+        method = _SESSION.put
+        if state_path is not None:
+            current = _SESSION.get(url, headers={"api-key": api_key}, timeout=30)
+            etag = current.headers.get("ETag") if current.ok else None
+            if etag:
+                if load_json_state(state_path) == {"etag": etag, "schema_sha256": schema_hash}:
+                    return current, True
+                headers["If-Match"] = etag
     else:
         # POST /indexes 建立（若已存在會回傳 409）
         url = f"{base_url}/indexes?api-version={api_version}"
-        method = requests.post
-    resp = method(url, headers=headers, data=json.dumps(body), timeout=30)
-    return resp
-
-
-def load_items_from_json(json_path: str) -> List[Dict[str, Any]]:
-    """從 it_knowledge.json 載入 items 陣列。"""
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+        method = _SESSION.post
+    resp = method(url, headers=headers, data=json_dumps(body), timeout=30)
+    new_etag = resp.headers.get("ETag")
+    if state_path is not None and resp.ok and new_etag:
+        save_json_state(state_path, {"etag": new_etag, "schema_sha256": schema_hash})
+    return resp, False
+
+
+@dataclass(slots=True)
+class Doc:
+    """上傳至索引的單筆文件；僅保留索引使用的欄位，於載入時正規化一次。"""
+
+    id: str
+    file_name: str
+    category: str
+    type: str
+    content: str
+
+    @classmethod
+    def from_item(cls, item: Any) -> Doc:
+        if not isinstance(item, dict):
+            raise ValueError(f"JSON 結構錯誤：items 的元素必須為物件，實際為 {type(item).__name__}。")
+        return cls(
+            id=str(item.get("id", "")),
+            file_name=item.get("file_name", ""),
+            category=item.get("category", ""),
+            type=item.get("type", ""),
+            content=item.get("content", ""),
+        )
+
+
+# 有 orjson 且檔案不超過此大小時，整檔以 mmap + orjson 解析；更大的檔案改為串流解析
+WHOLE_FILE_PARSE_MAX_BYTES = 64 * 1024 * 1024
+
+# 緊接在已解析數字後仍可能屬於同一個數字的字元（例如區塊邊界切在 "1." 或 "1e" 之後）
+_NUMBER_CONTINUATION_CHARS = frozenset("0123456789.eE+-")
+
+
+def iter_items_from_json(json_path: str) -> Iterator[Dict[str, Any]]:
+    """從 it_knowledge.json 逐筆讀出 items 陣列中的文件。"""
+    if orjson is not None and 0 < os.path.getsize(json_path) <= WHOLE_FILE_PARSE_MAX_BYTES:
+        return _load_items_with_mmap(json_path)
+    return _stream_items_from_json(json_path)
+
+
+def _load_items_with_mmap(json_path: str) -> Iterator[Dict[str, Any]]:
+    """以 mmap 對應檔案並直接交給 orjson 解析（於 Rust 內解碼 UTF-8），省去先複製成 str 的一份記憶體。"""
+    with open(json_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            data = orjson.loads(view)
+        finally:
+            view.release()
     items = data.get("items", []) if isinstance(data, dict) else []
     if not isinstance(items, list):
         raise ValueError("JSON 結構錯誤：缺少 items 陣列。")
-    return items
+    return iter(items)
 
 
-def chunked(seq: List[Any], size: int) -> List[List[Any]]:
-    return [seq[i : i + size] for i in range(0, len(seq), size)]
+def _stream_items_from_json(json_path: str, chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    """串流讀出 items 陣列中的文件。
 
+    以 JSONDecoder.raw_decode 分段解析，不需將整個檔案載入成 Python 物件，
+    上傳端可在檔案尚未讀完前就開始送出批次。
+    與整檔解析相同：沒有 items 鍵或最外層不是物件時視為空清單，items 不是陣列時拋出 ValueError。
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill(size: int = chunk_size) -> bool:
+            nonlocal buf, pos, eof
+            if eof:
+                return False
+            chunk = f.read(size)
+            if not chunk:
+                eof = True
+                return False
+            buf = buf[pos:] + chunk
+            pos = 0
+            return True
+
+        def peek() -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if not fill():
+                    return ""
+
+        def decode() -> Any:
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # 數字可能剛好被切在區塊邊界（"1.5" 只讀到 "1."），須確認後面是分隔字元
+                    if eof or (end < len(buf) and buf[end] not in _NUMBER_CONTINUATION_CHARS):
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                # 值跨越緩衝區時每次都得從頭重新解析；每次至少讀入與未解析部分等量的內容（緩衝倍增），
+                # 單筆大型文件的總解析量才會是線性而非平方
+                if not fill(max(chunk_size, len(buf) - pos)):
+                    value, pos = decoder.raw_decode(buf, pos)
+                    return value
+
+        def expect(ch: str) -> None:
+            nonlocal pos
+            if peek() != ch:
+                raise ValueError(f"JSON 結構錯誤：預期 '{ch}'。")
+            pos += 1
+
+        if peek() != "{":
+            # 最外層不是物件：仍完整解析以檢查格式，但沒有任何文件
+            decode()
+            return
+        pos += 1
+        while peek() != "}":
+            key = decode()
+            expect(":")
+            if key == "items":
+                if peek() != "[":
+                    raise ValueError("JSON 結構錯誤：缺少 items 陣列。")
+                pos += 1
+                while peek() != "]":
+                    yield decode()
+                    if peek() == ",":
+                        pos += 1
+                pos += 1
+            else:
+                decode()
+            if peek() == ",":
+                pos += 1
 
-def upload_documents(
-    service_name: str,
-    api_key: str,
-    api_version: str,
-    index_name: str,
-    docs: List[Dict[str, Any]],
-    batch_size: int = 1000,
-) -> Tuple[int, int]:
-    """將文件以批次上傳至 Azure AI Search。
 
-    回傳 (成功數, 失敗數)。
-    """
-    base_url = f"https://{service_name}.search.windows.net"
-    url = f"{base_url}/indexes('{index_name}')/docs/index?api-version={api_version}"
-    headers = {
-        "Content-Type": "application/json; charset=utf-8",
-        "api-key": api_key,
+# 單次 Index Documents 請求上限約 16 MB，保留空間給外層 JSON 與標頭
+DEFAULT_MAX_BATCH_BYTES = 14_000_000
+
+# 整批請求可重試的 HTTP 狀態（節流 / 服務暫時無法使用）
+_RETRY_BATCH_STATUSES = {429, 503, 504}
+# 207 部分失敗時，單筆文件可重試的 statusCode（版本衝突 / 暫時無法處理 / 服務忙碌）
+_RETRY_DOC_STATUSES = {409, 422, 503}
+
+# 已序列化的上傳動作：(文件 id, 該筆 action 的 JSON bytes)
+EncodedAction = Tuple[str, bytes]
+
+# 請求內容的固定前後綴，所有批次共用
+_PAYLOAD_PREFIX = b'{"value":['
+_PAYLOAD_SUFFIX = b"]}"
+
+
+def _encode_action(doc: Doc) -> EncodedAction:
+    action = {
+        "@search.action": "upload",
+        # 僅上傳必要欄位；contentVector 可留空以後續補齊
+        "id": doc.id,
+        "file_name": doc.file_name,
+        "category": doc.category,
+        "type": doc.type,
+        "content": doc.content,
     }
+    return doc.id, json_dumps(action)
+
+
+def _batch_payload(batch: List[EncodedAction]) -> bytes:
+    """將已序列化的各筆 action 直接串接成 {"value": [...]}，不再建立中介的 dict 清單。"""
+    return _PAYLOAD_PREFIX + b",".join([piece for _, piece in batch]) + _PAYLOAD_SUFFIX
+
+
+def iter_batches(actions: Iterable[EncodedAction], size: int, max_bytes: int = DEFAULT_MAX_BATCH_BYTES) -> Iterator[List[EncodedAction]]:
+    """依文件數上限 size 與序列化後的位元組上限 max_bytes 將已序列化的 action 分批。
 
+    每筆文件只序列化一次，所得 bytes 同時用於計算批次大小與組成請求內容。
+    任一上限將被超過時即送出目前批次；單筆即超過 max_bytes 的文件會自成一批。
+    """
+    batch: List[EncodedAction] = []
+    batch_bytes = 0
+    for encoded in actions:
+        doc_bytes = len(encoded[1]) + 1  # 含分隔的逗號
+        if batch and (len(batch) >= size or batch_bytes + doc_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(encoded)
+        batch_bytes += doc_bytes
+    if batch:
+        yield batch
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None, base: float = 1.0, cap: float = 60.0) -> float:
+    """指數退避秒數；若伺服器有給 Retry-After（秒）則以其為準，並加上少量抖動。"""
+    try:
+        delay = float(retry_after) if retry_after else min(cap, base * 2**attempt)
+    except ValueError:
+        delay = min(cap, base * 2**attempt)
+    return delay + random.uniform(0, base)
+
+
+def _send_batch_with_retry(
+    session: requests.Session,
+    url: str,
+    headers: Dict[str, str],
+    batch: List[EncodedAction],
+    max_retries: int = 5,
+    compress: bool = False,
+    succeeded: Optional[List[str]] = None,
+) -> Tuple[int, int]:
+    """上傳單一批次並以指數退避重試，回傳 (成功數, 失敗數)。
+
+    整批遇到 429/503/504 時整批重送；若回應為 207（部分失敗），只挑出可重試的
+    文件重新送出，已成功的文件不會重複上傳。遇到 413（請求過大）則將批次對半拆開。
+    compress=True 時以 gzip（level 1）壓縮請求內容，headers 需含 Content-Encoding: gzip。
+    若提供 succeeded，成功寫入的文件 id 會附加到該 list。
+    """
     success = 0
     failed = 0
+    pending = batch
 
-    for batch in chunked(docs, batch_size):
-        payload = {
-            "value": [
-                {
-                    "@search.action": "upload",
-                    # 僅上傳必要欄位；contentVector 可留空以後續補齊
-                    "id": str(doc.get("id", "")),
-                    "file_name": doc.get("file_name", ""),
-                    "category": doc.get("category", ""),
-                    "type": doc.get("type", ""),
-                    "content": doc.get("content", ""),
-                }
-                for doc in batch
-            ]
-        }
-
-        resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
+    for attempt in range(max_retries + 1):
+        data = _batch_payload(pending)
+        if compress:
+            data = gzip.compress(data, compresslevel=1)
+        resp = session.post(url, headers=headers, data=data, timeout=60)
         try:
-            result = resp.json()
+            result = json_loads(resp.content)
         except Exception:
             result = {"text": resp.text}
 
+        if resp.status_code == 413 and len(pending) > 1:
+            # 與 SearchIndexingBufferedSender 相同：請求過大時將批次對半拆開分別送出
+            mid = len(pending) // 2
+            for half in (pending[:mid], pending[mid:]):
+                succ, fail = _send_batch_with_retry(session, url, headers, half, max_retries, compress, succeeded)
+                success += succ
+                failed += fail
+            return success, failed
+
         if not resp.ok:
+            if resp.status_code in _RETRY_BATCH_STATUSES and attempt < max_retries:
+                time.sleep(_backoff_delay(attempt, resp.headers.get("Retry-After")))
+                continue
             print(f"[!] 文件批次上傳失敗（HTTP {resp.status_code}）：{result}")
-            failed += len(batch)
-            continue
+            return success, failed + len(pending)
 
         # 成功與失敗依回傳結果逐筆判斷
+        retry_keys = set()
         for res in result.get("value", []):
             if res.get("status") is True:
                 success += 1
+                if succeeded is not None:
+                    succeeded.append(res.get("key"))
+            elif res.get("statusCode") in _RETRY_DOC_STATUSES and attempt < max_retries:
+                retry_keys.add(res.get("key"))
             else:
                 failed += 1
 
+        if not retry_keys:
+            break
+        pending = [item for item in pending if item[0] in retry_keys]
+        time.sleep(_backoff_delay(attempt, resp.headers.get("Retry-After")))
+
     return success, failed
 
 
+T = TypeVar("T")
+_PREFETCH_END = object()
+
+
+def _prefetch(items: Iterable[T], maxsize: int) -> Iterator[T]:
+    """於背景執行緒預先產生 items（最多領先 maxsize 筆），讓產生端的 CPU 工作與呼叫端的等待重疊。
+
+    背景執行緒拋出的例外會在呼叫端重新拋出；呼叫端提前結束時背景執行緒也會停止。
+    """
+    q: queue.Queue[Tuple[Optional[BaseException], Any]] = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(entry: Tuple[Optional[BaseException], Any]) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((None, item)):
+                    return
+            put((None, _PREFETCH_END))
+        except BaseException as exc:
+            put((exc, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            exc, item = q.get()
+            if exc is not None:
+                raise exc
+            if item is _PREFETCH_END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def upload_documents(
+    service_name: str,
+    api_key: str,
+    api_version: str,
+    index_name: str,
+    docs: Iterable[Doc],
+    batch_size: int = 1000,
+    workers: int = 8,
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    compress: bool = False,
+    manifest: Optional[Dict[str, str]] = None,
+) -> Tuple[int, int, int]:
+    """將文件以批次上傳至 Azure AI Search，最多同時送出 workers 個批次。
+
+    Search 不要求批次依序抵達，因此各批次可並行上傳。docs 可為串流產生器，
+    同時在途的批次上限為 workers * 2，記憶體用量與文件總數無關。
+
+    若提供 manifest（文件 id -> 上次成功上傳內容的 SHA256），內容未變更的文件會略過，
+    本次成功上傳的文件則會更新其雜湊。回傳 (成功數, 失敗數, 略過數)。
+    """
+    base_url = f"https://{service_name}.search.windows.net"
+    url = f"{base_url}/indexes('{index_name}')/docs/index?api-version={api_version}"
+    headers = {
+        "Content-Type": "application/json; charset=utf-8",
+        "api-key": api_key,
+    }
+    if compress:
+        # 文件內容重複度高（欄位名稱、@search.action），gzip 通常可縮小數倍的傳輸量
+        headers["Content-Encoding"] = "gzip"
+
+    workers = max(1, workers)
+    # 文件上傳路徑改用不重試的 adapter（requests 依最長前綴選用 adapter）：
+    # 429/503/504 只由 _send_batch_with_retry 重試一層，避免兩層重試相乘、同一大批次被重送數十次。
+    # 連線池也需足以容納所有 worker，避免執行緒互相等待連線。
+    _SESSION.mount(f"{base_url}/indexes('{index_name}')/docs/", build_adapter(pool_maxsize=max(32, workers), retries=False))
+
+    hashes: Dict[str, str] = {}
+    skipped = 0
+
+    def changed(actions: Iterable[EncodedAction]) -> Iterator[EncodedAction]:
+        nonlocal skipped
+        for doc_id, piece in actions:
+            if manifest is not None:
+                digest = hashlib.sha256(piece).hexdigest()
+                if manifest.get(doc_id) == digest:
+                    skipped += 1
+                    continue
+                hashes[doc_id] = digest
+            yield doc_id, piece
+
+    success = 0
+    failed = 0
+    succeeded: List[str] = []
+    pending = set()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            # JSON 解析、序列化與 SHA256 在背景執行緒進行，主執行緒等待批次完成時不會停擺
+            actions = _prefetch(changed(map(_encode_action, docs)), maxsize=max(1, batch_size) * 2)
+            for batch in iter_batches(actions, batch_size, max_batch_bytes):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        succ, fail = fut.result()
+                        success += succ
+                        failed += fail
+                pending.add(ex.submit(_send_batch_with_retry, _SESSION, url, headers, batch, 5, compress, succeeded))
+            for fut in wait(pending).done:
+                succ, fail = fut.result()
+                success += succ
+                failed += fail
+    finally:
+        if manifest is not None:
+            for doc_id in succeeded:
+                if doc_id in hashes:
+                    manifest[doc_id] = hashes[doc_id]
+
+    if skipped:
+        print(f"[i] 略過 {skipped} 筆未變更的文件（與上次成功上傳的內容相同）")
+    return success, failed, skipped
+
+
 def parse_args() -> argparse.Namespace:
     load_dotenv()  # Load from .env if present
     parser = argparse.ArgumentParser(description="建立或更新 Azure AI Search index（REST）")
@@ -276,7 +652,26 @@ def parse_args() -> argparse.Namespace:
         "--batch-size",
         type=int,
         default=_env_int("BATCH_SIZE", 1000),
-        help="批次上傳大小（預設：1000；亦可用環境變數 BATCH_SIZE）",
+        help="每批最多文件數（預設：1000；亦可用環境變數 BATCH_SIZE）",
+    )
+    parser.add_argument(
+        "--max-batch-bytes",
+        type=int,
+        default=_env_int("MAX_BATCH_BYTES", DEFAULT_MAX_BATCH_BYTES),
+        help="每批序列化後的位元組上限（預設：14000000，服務上限約 16 MB；亦可用環境變數 MAX_BATCH_BYTES）",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=_env_int("WORKERS", 8),
+        help="同時上傳的批次數（預設：8；亦可用環境變數 WORKERS）",
+    )
+    parser.add_argument(
+        "--gzip",
+        dest="gzip_upload",
+        action="store_true",
+        default=_env_bool("UPLOAD_GZIP", False),
+        help="以 gzip 壓縮文件上傳的請求內容（亦可用環境變數 UPLOAD_GZIP）",
     )
     parser.add_argument(
         "--schema-only",
@@ -294,13 +689,19 @@ def main() -> int:
         print(f"ERROR: 缺少必要參數：{', '.join(missing)}")
         return 2
 
-    resp = create_or_update_index(
+    # 索引狀態：預設存放於 .cache/search_index/<service>_<index>.json；INDEX_STATE=false 可停用
+    state_path: Optional[Path] = None
+    if _env_bool("INDEX_STATE", True):
+        state_path = Path(_env_value("INDEX_STATE_DIR") or (REPO_ROOT / ".cache" / "search_index")) / f"{args.service_name}_{args.index_name}.json"
+
+    resp, unchanged = create_or_update_index(
         service_name=args.service_name,
         api_key=args.api_key,
         api_version=args.api_version,
         index_name=args.index_name,
         embedding_dimensions=args.embedding_dimensions,
         overwrite=bool(args.overwrite),
+        state_path=state_path,
     )
 
     try:
@@ -309,9 +710,12 @@ def main() -> int:
         payload = {"text": resp.text}
 
     if resp.ok:
-        action = "updated" if args.overwrite else "created"
-        print(f"[+] Index '{args.index_name}' {action} successfully. Status: {resp.status_code}")
-        print(json.dumps(payload, indent=2))
+        if unchanged:
+            print(f"[=] Index '{args.index_name}' 結構未變更，略過 PUT。")
+        else:
+            action = "updated" if args.overwrite else "created"
+            print(f"[+] Index '{args.index_name}' {action} successfully. Status: {resp.status_code}")
+            print(json.dumps(payload, indent=2))
         # 若僅建立 schema，直接結束
         if args.schema_only:
             return 0
@@ -329,19 +733,32 @@ def main() -> int:
                 if os.path.exists(candidate):
                     json_path = candidate
 
-            items = load_items_from_json(json_path)
-            if not items:
+            # 上傳紀錄：預設存放於 .cache/search_upload/<service>_<index>.json；UPLOAD_MANIFEST=false 可停用
+            manifest: Optional[Dict[str, str]] = None
+            manifest_path = Path(_env_value("UPLOAD_MANIFEST_DIR") or (REPO_ROOT / ".cache" / "search_upload")) / f"{args.service_name}_{args.index_name}.json"
+            if _env_bool("UPLOAD_MANIFEST", True):
+                # 201 代表索引剛建立（內容為空），舊紀錄已不適用
+                manifest = {} if resp.status_code == 201 else load_json_state(manifest_path)
+
+            try:
+                success, failed, skipped = upload_documents(
+                    service_name=args.service_name,
+                    api_key=args.api_key,
+                    api_version=args.api_version,
+                    index_name=args.index_name,
+                    docs=map(Doc.from_item, iter_items_from_json(json_path)),
+                    batch_size=args.batch_size,
+                    workers=args.workers,
+                    max_batch_bytes=args.max_batch_bytes,
+                    compress=bool(args.gzip_upload),
+                    manifest=manifest,
+                )
+            finally:
+                if manifest is not None:
+                    save_json_state(manifest_path, manifest)
+            if success + failed + skipped == 0:
                 print("[i] 找不到可上傳的文件（items 為空）。")
                 return 0
-
-            success, failed = upload_documents(
-                service_name=args.service_name,
-                api_key=args.api_key,
-                api_version=args.api_version,
-                index_name=args.index_name,
-                docs=items,
-                batch_size=args.batch_size,
-            )
             print(f"[+] 文件上傳完成：成功 {success} 筆，失敗 {failed} 筆。")
             return 0 if failed == 0 else 1
         except Exception as ex:
@@ -353,6 +770,8 @@ def main() -> int:
         # 若 POST 衝突，提供提示
         if resp.status_code == 409 and not args.overwrite:
             print("提示：使用 --overwrite 以 PUT 更新既有索引。")
+        elif resp.status_code == 412:
+            print("提示：讀取 ETag 後索引已被其他程序修改，請重新執行。")
         return 1
 
 
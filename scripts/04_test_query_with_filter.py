@@ -6,6 +6,10 @@
   - 可選 FILTER（原生 OData 條件字串），或使用 --category/--type 組合
   - 可選 USE_VECTOR=true 啟用向量查詢（需提供查詢向量）
   - 如需自動產生向量，可設定 AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY, AZURE_OPENAI_EMBEDDING_DEPLOYMENT
+  - 查詢向量會快取於 .cache/embeddings（dbm，以 float32 壓縮儲存），相同查詢不再呼叫 Azure OpenAI；
+    可用 EMBEDDING_CACHE=false 停用、EMBEDDING_CACHE_PATH 調整位置
+  - 可用 --queries-file 一次執行多筆查詢（每行一筆查詢字串，或 testset.jsonl 格式的 {"query": ...}），
+    以 --workers（或 WORKERS，預設 8）個執行緒同時送出
 
 注意：若索引中文件尚未寫入 contentVector（無向量），請使用純文字查詢（--use-vector 不要開啟）。
 參考文件：https://learn.microsoft.com/azure/search/vector-search-filters
@@ -13,20 +17,42 @@
 from __future__ import annotations
 
 import argparse
+import atexit
+import dbm
+import functools
+import hashlib
 import json
 import os
-from typing import Any, Dict, List, Optional
+import threading
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
 
 import requests
 from dotenv import load_dotenv
 
+from _common import build_adapter, build_session, json_dumps, json_loads
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+_SESSION = build_session()
+
 
 # --- Env helpers -------------------------------------------------------------
+# 環境變數前後需去除的空白與引號（.env 中的值可能帶引號）
+_ENV_STRIP_CHARS = " \t\r\n\"'"
+
+
+# 參數解析時已先呼叫 load_dotenv()，之後環境變數不再變動，可安全快取
+@functools.cache
 def _env_value(name: str, default: Optional[str] = None) -> Optional[str]:
     v = os.getenv(name)
     if v is None:
         return default
-    v = v.strip().strip('"').strip("'")
+    v = v.strip(_ENV_STRIP_CHARS)
     return v if v != "" else default
 
 
@@ -37,6 +63,16 @@ def _env_bool(name: str, default: bool = False) -> bool:
     return v.lower() in {"1", "true", "yes", "on", "y", "t"}
 
 
+def _env_int(name: str, default: int) -> int:
+    v = _env_value(name)
+    if v is None:
+        return default
+    try:
+        return int(v)
+    except Exception:
+        return default
+
+
 def build_filter(category: Optional[str], type_: Optional[str], raw: Optional[str]) -> Optional[str]:
     if raw:
         return raw
@@ -48,21 +84,61 @@ def build_filter(category: Optional[str], type_: Optional[str], raw: Optional[st
     return " and ".join(parts) if parts else None
 
 
+# dbm 物件不是執行緒安全的；整個行程共用一個已開啟的 dbm，多筆查詢並行時只在讀寫時持有此鎖
+_EMB_CACHE_LOCK = threading.Lock()
+
+
+@functools.cache
+def _open_embedding_cache() -> Optional[Any]:
+    """開啟 embedding 快取（dbm）並於行程結束時關閉；EMBEDDING_CACHE=false 時回傳 None。"""
+    if not _env_bool("EMBEDDING_CACHE", True):
+        return None
+    path = Path(_env_value("EMBEDDING_CACHE_PATH") or (REPO_ROOT / ".cache" / "embeddings"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = dbm.open(str(path), "c")
+    atexit.register(db.close)
+    return db
+
+
+def _embedding_cache() -> Optional[Any]:
+    # functools.cache 不防止並行的第一次呼叫，持鎖確保 dbm 只開啟一次
+    with _EMB_CACHE_LOCK:
+        return _open_embedding_cache()
+
+
 def get_embedding(query_text: str) -> Optional[List[float]]:
-    """可選：透過 Azure OpenAI 取得 embedding（需 .env 提供金鑰與部署名）。"""
+    """可選：透過 Azure OpenAI 取得 embedding（需 .env 提供金鑰與部署名）。
+
+    索引的 contentVector 為 Collection(Edm.Single)，因此一律先捨入為 float32：快取以 float32 bytes
+    儲存（每維 4 bytes），命中與未命中快取時回傳完全相同的值。
+    """
     endpoint = _env_value("AZURE_OPENAI_ENDPOINT")
     api_key = _env_value("AZURE_OPENAI_API_KEY") or _env_value("AZURE_OPENAI_KEY")
     deployment = _env_value("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
     if not (endpoint and api_key and deployment):
         return None
 
+    # 以端點 + 部署 + 查詢字串的 SHA256 為鍵；值為 zlib 壓縮後的 float32 bytes
+    key = hashlib.sha256(f"{endpoint}|{deployment}|{query_text}".encode("utf-8")).digest()
+    db = _embedding_cache()
+    if db is not None:
+        with _EMB_CACHE_LOCK:
+            cached = db.get(key)
+        if cached is not None:
+            return array("f", zlib.decompress(cached)).tolist()
+
     url = f"{endpoint.rstrip('/')}/openai/deployments/{deployment}/embeddings?api-version=2023-05-15"
     headers = {"Content-Type": "application/json", "api-key": api_key}
     body = {"input": query_text}
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = _SESSION.post(url, headers=headers, data=json_dumps(body), timeout=30)
     resp.raise_for_status()
-    data = resp.json()
-    return data["data"][0]["embedding"]
+    data = json_loads(resp.content)
+    embedding = array("f", data["data"][0]["embedding"])
+
+    if db is not None:
+        with _EMB_CACHE_LOCK:
+            db[key] = zlib.compress(embedding.tobytes())
+    return embedding.tolist()
 
 
 def search_with_text(service: str, key: str, index: str, api_version: str, query_text: str, filter_expr: Optional[str], top: int) -> Dict[str, Any]:
@@ -76,33 +152,91 @@ def search_with_text(service: str, key: str, index: str, api_version: str, query
     }
     if filter_expr:
         body["filter"] = filter_expr
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = _SESSION.post(url, headers=headers, data=json_dumps(body), timeout=30)
     return {"ok": resp.ok, "status": resp.status_code, "json": _safe_json(resp)}
 
 
-def search_with_vector(service: str, key: str, index: str, api_version: str, vector: List[float], filter_expr: Optional[str], top: int) -> Dict[str, Any]:
+def search_with_vector(service: str, key: str, index: str, api_version: str, vector: Sequence[float], filter_expr: Optional[str], top: int) -> Dict[str, Any]:
     base = f"https://{service}.search.windows.net"
     url = f"{base}/indexes('{index}')/docs/search?api-version={api_version}"
     headers = {"Content-Type": "application/json; charset=utf-8", "api-key": key}
     body: Dict[str, Any] = {
         "vectors": [
-            {"value": vector, "fields": "contentVector", "k": top}
+            {"value": list(vector), "fields": "contentVector", "k": top}
         ],
         "select": "id,file_name,category,type",
     }
     if filter_expr:
         body["filter"] = filter_expr
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = _SESSION.post(url, headers=headers, data=json_dumps(body), timeout=30)
     return {"ok": resp.ok, "status": resp.status_code, "json": _safe_json(resp)}
 
 
 def _safe_json(resp: requests.Response) -> Any:
     try:
-        return resp.json()
+        return json_loads(resp.content)
     except Exception:
         return {"text": resp.text}
 
 
+def load_queries(path: str) -> List[str]:
+    """讀取查詢清單：每行一筆查詢字串；若為 JSON 物件（如 testset.jsonl）則取其 query 欄位。
+
+    以 '{' 開頭但無法解析為 JSON 的行視為一般查詢字串；沒有 query 欄位的 JSON 物件略過。
+    """
+    queries: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            query = raw.strip()
+            if query.startswith("{"):
+                try:
+                    obj = json_loads(query)
+                except ValueError:
+                    obj = None
+                if isinstance(obj, dict):
+                    if "query" not in obj:
+                        continue
+                    query = str(obj["query"]).strip()
+            if query:
+                queries.append(query)
+    return queries
+
+
+def run_query(args: argparse.Namespace, query_text: str, filter_expr: Optional[str]) -> Dict[str, Any]:
+    """依 --use-vector 選擇向量或純文字查詢；無法取得 embedding 時退回純文字查詢。"""
+    if args.use_vector:
+        emb = get_embedding(query_text)
+        if emb:
+            return search_with_vector(args.service_name, args.api_key, args.index_name, args.api_version, emb, filter_expr, args.top)
+        print("[i] 無法取得 embedding，改用純文字查詢。請在 .env 設定 AZURE_OPENAI_* 以啟用向量查詢。")
+    return search_with_text(args.service_name, args.api_key, args.index_name, args.api_version, query_text, filter_expr, args.top)
+
+
+def run_queries(args: argparse.Namespace, queries: List[str], filter_expr: Optional[str]) -> List[Dict[str, Any]]:
+    """以執行緒池同時執行多筆查詢（皆為 I/O 等待），結果順序與 queries 相同。"""
+    workers = max(1, args.workers)
+    if workers > 32:
+        # 讓連線池足以容納所有 worker，避免執行緒互相等待連線
+        _SESSION.mount("https://", build_adapter(pool_maxsize=workers))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(lambda q: run_query(args, q, filter_expr), queries))
+
+
+def print_result(result: Dict[str, Any]) -> bool:
+    ok = result["ok"]
+    status = result["status"]
+    payload = result["json"]
+    if ok:
+        hits = payload.get("value", [])
+        print(f"[+] 查詢成功（HTTP {status}）。共 {len(hits)} 筆結果。")
+        for i, doc in enumerate(hits, 1):
+            print(f"  {i}. id={doc.get('id')} | file={doc.get('file_name')} | category={doc.get('category')} | type={doc.get('type')} | score={doc.get('@search.score')}")
+    else:
+        print(f"[!] 查詢失敗（HTTP {status}）")
+        print(json.dumps(payload, indent=2, ensure_ascii=False))
+    return ok
+
+
 def parse_args() -> argparse.Namespace:
     load_dotenv()
     p = argparse.ArgumentParser(description="測試 Azure AI Search 查詢與 Filter")
@@ -111,6 +245,8 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--index-name", default=_env_value("INDEX_NAME", "it-knowledge-index"))
     p.add_argument("--api-version", default=_env_value("API_VERSION", "2023-11-01"))
     p.add_argument("--query-text", default=_env_value("QUERY_TEXT", "vpn"))
+    p.add_argument("--queries-file", default=_env_value("QUERIES_FILE"), help="多筆查詢檔（每行一筆，或 testset.jsonl）")
+    p.add_argument("--workers", type=int, default=_env_int("WORKERS", 8), help="多筆查詢時的同時請求數")
     p.add_argument("--category", default=_env_value("CATEGORY"))
     p.add_argument("--type", dest="type_", default=_env_value("TYPE"))
     p.add_argument("--filter", dest="raw_filter", default=_env_value("FILTER"))
@@ -128,29 +264,19 @@ def main() -> int:
 
     filter_expr = build_filter(args.category, args.type_, args.raw_filter)
 
-    if args.use_vector:
-        emb = get_embedding(args.query_text)
-        if not emb:
-            print("[i] 無法取得 embedding，改用純文字查詢。請在 .env 設定 AZURE_OPENAI_* 以啟用向量查詢。")
-            result = search_with_text(args.service_name, args.api_key, args.index_name, args.api_version, args.query_text, filter_expr, args.top)
-        else:
-            result = search_with_vector(args.service_name, args.api_key, args.index_name, args.api_version, emb, filter_expr, args.top)
-    else:
-        result = search_with_text(args.service_name, args.api_key, args.index_name, args.api_version, args.query_text, filter_expr, args.top)
+    if args.queries_file:
+        queries = load_queries(args.queries_file)
+        results = run_queries(args, queries, filter_expr)
+        failed = 0
+        for query_text, result in zip(queries, results):
+            print(f"\n=== {query_text}")
+            if not print_result(result):
+                failed += 1
+        print(f"\n[+] 共執行 {len(queries)} 筆查詢，失敗 {failed} 筆。")
+        return 0 if failed == 0 else 1
 
-    ok = result["ok"]
-    status = result["status"]
-    payload = result["json"]
-    if ok:
-        hits = payload.get("value", [])
-        print(f"[+] 查詢成功（HTTP {status}）。共 {len(hits)} 筆結果。")
-        for i, doc in enumerate(hits, 1):
-            print(f"  {i}. id={doc.get('id')} | file={doc.get('file_name')} | category={doc.get('category')} | type={doc.get('type')} | score={doc.get('@search.score')}")
-        return 0
-    else:
-        print(f"[!] 查詢失敗（HTTP {status}）")
-        print(json.dumps(payload, indent=2, ensure_ascii=False))
-        return 1
+    result = run_query(args, args.query_text, filter_expr)
+    return 0 if print_result(result) else 1
 
 
 if __name__ == "__main__":
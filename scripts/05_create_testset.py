@@ -18,21 +18,33 @@
 
 from __future__ import annotations
 
+import hashlib
 import json
 import os
+import random
 import re
 import sys
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import requests
 from dotenv import load_dotenv
 
 # Azure AI Agents SDKs（保留英文專有名詞）
-from azure.identity import DefaultAzureCredential
+from azure.core.exceptions import HttpResponseError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.identity import (
+	DefaultAzureCredential,
+	TokenCachePersistenceOptions,
+)
 from azure.ai.projects import AIProjectClient
-from azure.ai.agents.models import FilePurpose, FileSearchTool, ListSortOrder
+from azure.ai.agents.models import AgentsResponseFormat, FilePurpose, FileSearchTool, ListSortOrder
+
+from _common import build_adapter, json_dumps, load_json_state, save_json_state
 
 
 # ---------------------------
@@ -55,12 +67,57 @@ QA_PER_SUBFOLDER = int(os.environ.get("QA_PER_SUBFOLDER", "10"))
 # 檔案上傳限制（避免誤上傳過大的二進位）
 MAX_FILE_SIZE_MB = float(os.environ.get("MAX_FILE_SIZE_MB", "25"))  # 預設 25 MB
 
+# file search 可索引的副檔名；其餘（圖片、壓縮檔等）不上傳
+INDEXABLE_EXTS = {
+	".c", ".cpp", ".cs", ".css", ".csv", ".doc", ".docx", ".go", ".html", ".java", ".js", ".json",
+	".md", ".pdf", ".php", ".pptx", ".py", ".rb", ".sh", ".tex", ".ts", ".txt",
+}
+
 # Vector store 成本控管：自上次使用後 N 天自動過期
 VECTORSTORE_EXPIRE_DAYS = int(os.environ.get("VECTORSTORE_EXPIRE_DAYS", "7"))
 
+# 以 JSON mode（response_format=json_object）限制 agent 只輸出 JSON 物件；部署不支援時可設為 false
+QA_JSON_MODE = os.environ.get("QA_JSON_MODE", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+# Agent run 輪詢設定
+TERMINAL_RUN_STATUSES = ("completed", "failed", "cancelled", "expired")
+RUN_TIMEOUT_SEC = float(os.environ.get("RUN_TIMEOUT_SEC", "180"))
+
+# 同時處理的子資料夾數（各子資料夾的工作主要在等待 Azure 回應）
+SUBFOLDER_CONCURRENCY = int(os.environ.get("SUBFOLDER_CONCURRENCY", "4"))
+
+# 單次建立 vector store / file batch 可帶入的檔案數上限
+VECTOR_STORE_BATCH_SIZE = 500
+
+# 單一 vector store 的檔案數上限；超過時分成多個 vector store 平行建立與出題（0 表示不分割）
+MAX_FILES_PER_VS = int(os.environ.get("MAX_FILES_PER_VS", "64"))
+
+# 每個子資料夾內同時上傳的檔案數
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "8"))
+
+# 互動式登入的 token 快取是否寫入作業系統的安全儲存區，讓重複執行時免再登入（選用）
+TOKEN_CACHE_PERSIST = os.environ.get("TOKEN_CACHE_PERSIST", "false").strip().lower() in {"1", "true", "yes", "on"}
+
+# Azure AI Foundry 專案 API 的 token scope
+PROJECT_TOKEN_SCOPE = "https://ai.azure.com/.default"
+
+# SDK 連線池大小：需涵蓋同時上傳／輪詢的請求數，否則多出的請求會各自重新握手
+HTTP_POOL_SIZE = max(32, SUBFOLDER_CONCURRENCY * UPLOAD_CONCURRENCY)
+
+# 跨執行的上傳快取（選用）：檔案 SHA256 -> file id、資料夾內容雜湊 -> vector store id。
+# 啟用後 vector store 不會在結束時刪除，而是保留至 VECTORSTORE_EXPIRE_DAYS 後由服務端自動過期。
+TESTSET_CACHE = os.environ.get("TESTSET_CACHE", "false").strip().lower() in {"1", "true", "yes", "on"}
+TESTSET_CACHE_PATH = Path(
+	os.environ.get("TESTSET_CACHE_PATH", Path(__file__).resolve().parents[1] / ".cache" / "testset_upload.json")
+)
+
 # 簡易重試設定（因應暫時性錯誤）
 MAX_RETRIES = 3
 RETRY_BACKOFF_SEC = 2.0
+RETRY_BACKOFF_MAX_SEC = 30.0
+
+# 模型回覆外層的 code fence（```json ... ```）
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE | re.MULTILINE)
 
 
 @dataclass
@@ -75,11 +132,39 @@ def _iter_subfolders(root: Path) -> Iterable[Path]:
 			yield p
 
 
-def _iter_files(folder: Path) -> Iterable[Path]:
-	# 包含所有一般檔案；依需求處理每個子資料夾的所有檔案
-	for p in sorted(folder.rglob("*")):
-		if p.is_file():
-			yield p
+def _iter_files(folder: Path) -> List[Tuple[Path, int]]:
+	"""回傳 (path, size_bytes)，僅包含 file search 能索引的非空檔案。
+
+	圖片、壓縮檔等附件上傳了也無法檢索，直接略過。以 os.scandir 走訪，檔案大小取自 DirEntry.stat()，
+	每個檔案只 stat 一次。順序與 sorted(Path) 相同（快取雜湊依賴此順序）。
+	"""
+	files: List[Tuple[Path, int]] = []
+	skipped = 0
+	stack = [folder]
+	while stack:
+		with os.scandir(stack.pop()) as it:
+			for entry in it:
+				if entry.is_dir(follow_symlinks=False):
+					stack.append(Path(entry.path))
+				elif entry.is_file():
+					size = entry.stat().st_size
+					if os.path.splitext(entry.name)[1].lower() in INDEXABLE_EXTS and size > 0:
+						files.append((Path(entry.path), size))
+					else:
+						skipped += 1
+	if skipped:
+		print(f"Skipping {skipped} non-indexable or empty files in {folder.name}.")
+	return sorted(files)
+
+
+def _retry_after_sec(exc: Exception) -> Optional[float]:
+	"""若例外帶有服務端的 Retry-After（秒數）標頭則回傳之。"""
+	if not isinstance(exc, HttpResponseError) or exc.response is None:
+		return None
+	try:
+		return float(exc.response.headers.get("Retry-After"))
+	except (TypeError, ValueError):
+		return None
 
 
 def retryable(fn, *args, **kwargs):
@@ -89,66 +174,296 @@ def retryable(fn, *args, **kwargs):
 			return fn(*args, **kwargs)
 		except Exception as e:  # noqa: BLE001 – broad to provide resilience
 			last_exc = e
-			sleep_for = RETRY_BACKOFF_SEC * attempt
+			if attempt == MAX_RETRIES:
+				break
+			# 指數退避 + full jitter，避免多個 worker 在 429/503 後同步重試；服務端指定 Retry-After 時優先採用
+			sleep_for = _retry_after_sec(e)
+			if sleep_for is None:
+				sleep_for = random.uniform(0, min(RETRY_BACKOFF_SEC * (2 ** (attempt - 1)), RETRY_BACKOFF_MAX_SEC))
 			print(f"Warning: attempt {attempt} failed: {e}. Retrying in {sleep_for:.1f}s...")
 			time.sleep(sleep_for)
 	if last_exc:
 		raise last_exc
 
 
-def _file_size_mb(path: Path) -> float:
+def _probe_file(path: Path, size: int, with_hash: bool = False) -> Tuple[float, Optional[str]]:
+	"""回傳 (size_mb, sha256_hex)。
+
+	size 為走訪時已取得的檔案大小；需要雜湊時才以 1 MB 分塊讀檔一次，同時計算雜湊與實際大小。
+	過大的檔案不做雜湊（反正會被略過）。
+	"""
+	if not with_hash or (MAX_FILE_SIZE_MB > 0 and size / (1024 * 1024) > MAX_FILE_SIZE_MB):
+		return size / (1024 * 1024), None
+	h = hashlib.sha256()
+	size = 0
+	with path.open("rb") as f:
+		while chunk := f.read(1 << 20):
+			h.update(chunk)
+			size += len(chunk)
+	return size / (1024 * 1024), h.hexdigest()
+
+
+def load_cache(path: Path) -> dict:
+	"""讀取上傳快取；檔案不存在或損毀時回傳空快取。"""
+	data = load_json_state(path)
+	data.setdefault("files", {})
+	data.setdefault("vector_stores", {})
+	return data
+
+
+def save_cache(path: Path, cache: dict) -> None:
+	# 其他執行緒可能仍在更新 cache，序列化時須持有鎖
+	with _CACHE_LOCK:
+		save_json_state(path, cache)
+
+
+_CACHE_LOCK = threading.Lock()
+
+# 本次執行內已上傳（或正在上傳）的檔案：SHA256 -> Future[file id]。
+# 多個子資料夾中內容相同的檔案（例如共用的 README 範本）只上傳一次，各 vector store 共用同一個 file id。
+_UPLOADS: Dict[str, Future[Optional[str]]] = {}
+_UPLOADS_LOCK = threading.Lock()
+
+
+def _cached_file_id(agents_client, cache: Optional[dict], digest: Optional[str]) -> Optional[str]:
+	"""若快取中的 file id 在服務端仍存在則回傳之。"""
+	if cache is None or digest is None:
+		return None
+	with _CACHE_LOCK:
+		file_id = cache["files"].get(digest)
+	if not file_id:
+		return None
 	try:
-		return path.stat().st_size / (1024 * 1024)
+		agents_client.files.get(file_id)
+		return file_id
 	except Exception:
-		return 0.0
+		with _CACHE_LOCK:
+			cache["files"].pop(digest, None)
+		return None
 
 
-def upload_files_and_create_vector_store(agents_client, folder: Path) -> Tuple[str, List[str]]:
-	"""Uploads all files in folder and returns (vector_store_id, file_ids)."""
-	file_ids: List[str] = []
-	for f in _iter_files(folder):
-	# 預設略過過大的檔案
-		size_mb = _file_size_mb(f)
-		if MAX_FILE_SIZE_MB > 0 and size_mb > MAX_FILE_SIZE_MB:
-			print(f"Skipping (>{MAX_FILE_SIZE_MB}MB): {f} ({size_mb:.2f} MB)")
-			continue
-		try:
-			print(f"Uploading: {f}")
-			uploaded = retryable(
-				agents_client.files.upload_and_poll,
-				file_path=str(f),
-				purpose=FilePurpose.AGENTS,
-			)
-			file_ids.append(uploaded.id)
-		except Exception as e:
-			print(f"Error uploading {f}: {e}. Skipping.")
+def _cached_vector_store(agents_client, cache: Optional[dict], folder_hash: str) -> Optional[dict]:
+	"""若相同內容的 vector store 尚未過期且仍可用，回傳其快取紀錄。"""
+	if cache is None:
+		return None
+	with _CACHE_LOCK:
+		entry = cache["vector_stores"].get(folder_hash)
+	# 保留 1 小時緩衝，避免使用途中剛好過期
+	if not entry or time.time() - entry.get("last_used", 0) > VECTORSTORE_EXPIRE_DAYS * 86400 - 3600:
+		return None
+	try:
+		vs = agents_client.vector_stores.get(entry["id"])
+		if getattr(vs, "status", None) == "completed":
+			return entry
+	except Exception:
+		pass
+	with _CACHE_LOCK:
+		cache["vector_stores"].pop(folder_hash, None)
+	return None
 
-	if not file_ids:
-		raise RuntimeError(f"No files uploaded from folder: {folder}")
 
-	print(f"Creating vector store for {folder.name} with {len(file_ids)} files (expire {VECTORSTORE_EXPIRE_DAYS}d after last active)...")
+def _is_cached_vector_store(cache: Optional[dict], vector_store_id: str) -> bool:
+	"""vector store 是否已記錄於快取（會留給下次執行沿用）。"""
+	if cache is None:
+		return False
+	with _CACHE_LOCK:
+		return any(entry.get("id") == vector_store_id for entry in cache["vector_stores"].values())
+
+
+def _upload_file(agents_client, path: Path, cache: Optional[dict] = None, digest: Optional[str] = None) -> Optional[str]:
+	"""上傳單一檔案並回傳 file id（同內容已上傳或快取命中時直接沿用）；失敗時記錄訊息並回傳 None。"""
+	if digest is None:
+		return _upload_file_once(agents_client, path, cache, digest)
+	with _UPLOADS_LOCK:
+		shared = _UPLOADS.get(digest)
+		if shared is None:
+			_UPLOADS[digest] = owned = Future()
+	if shared is not None:
+		# 其他 worker 已負責上傳相同內容，等待其結果即可
+		file_id = shared.result()
+		if file_id:
+			print(f"Reusing uploaded file: {path} ({file_id})")
+		return file_id
+	file_id = None
+	try:
+		file_id = _upload_file_once(agents_client, path, cache, digest)
+		return file_id
+	finally:
+		owned.set_result(file_id)
+
+
+def _upload_file_once(agents_client, path: Path, cache: Optional[dict], digest: Optional[str]) -> Optional[str]:
+	"""實際上傳（或自上傳快取沿用）單一檔案。"""
+	file_id = _cached_file_id(agents_client, cache, digest)
+	if file_id:
+		print(f"Reusing uploaded file: {path} ({file_id})")
+		return file_id
+	try:
+		print(f"Uploading: {path}")
+		uploaded = retryable(
+			agents_client.files.upload_and_poll,
+			file_path=str(path),
+			purpose=FilePurpose.AGENTS,
+		)
+		if cache is not None and digest is not None:
+			with _CACHE_LOCK:
+				cache["files"][digest] = uploaded.id
+		return uploaded.id
+	except Exception as e:
+		print(f"Error uploading {path}: {e}. Skipping.")
+		return None
+
+
+def _create_vector_store(agents_client, name: str, file_ids: List[str]) -> str:
+	"""以 file_ids 建立 vector store 並等待匯入完成，回傳其 id。"""
+	# 建立時一次帶入第一批檔案，其餘以 file batch 交由服務端批次匯入
+	first, rest = file_ids[:VECTOR_STORE_BATCH_SIZE], file_ids[VECTOR_STORE_BATCH_SIZE:]
 	vector_store = retryable(
 		agents_client.vector_stores.create_and_poll,
-		file_ids=file_ids,
-		name=f"wiki_export_{folder.name}",
+		file_ids=first,
+		name=name,
 		expires_after={
 			"anchor": "last_active_at",
 			"days": VECTORSTORE_EXPIRE_DAYS,
 		},
 	)
-	return vector_store.id, file_ids
+	for i in range(0, len(rest), VECTOR_STORE_BATCH_SIZE):
+		retryable(
+			agents_client.vector_store_file_batches.create_and_poll,
+			vector_store_id=vector_store.id,
+			file_ids=rest[i : i + VECTOR_STORE_BATCH_SIZE],
+		)
+	return vector_store.id
 
 
-def create_agent_with_file_search(agents_client, vector_store_id: str, name: str):
-	file_search = FileSearchTool(vector_store_ids=[vector_store_id])
+def upload_files_and_create_vector_stores(
+	agents_client, folder: Path, cache: Optional[dict] = None
+) -> Tuple[List[str], List[str]]:
+	"""Uploads all files in folder and returns (vector_store_ids, file_ids).
+
+	檔案超過 MAX_FILES_PER_VS 時分成多個 vector store 平行建立，縮短單一資料夾的匯入等待；
+	分割數不超過 QA_PER_SUBFOLDER，確保每個 vector store 至少分配到一組問答。
+	提供 cache 時，內容相同的檔案與 vector store 會沿用先前執行時建立的資源。
+	"""
+	paths: List[Path] = []
+	digests: List[Optional[str]] = []
+	for f, size in _iter_files(folder):
+		# 預設略過過大的檔案；同一次讀檔順便算出雜湊，供跨子資料夾去重與上傳快取使用
+		size_mb, digest = _probe_file(f, size, with_hash=True)
+		if MAX_FILE_SIZE_MB > 0 and size_mb > MAX_FILE_SIZE_MB:
+			print(f"Skipping (>{MAX_FILE_SIZE_MB}MB): {f} ({size_mb:.2f} MB)")
+			continue
+		paths.append(f)
+		digests.append(digest)
+
+	per_store = len(paths)
+	if MAX_FILES_PER_VS > 0:
+		per_store = max(MAX_FILES_PER_VS, -(-len(paths) // max(1, QA_PER_SUBFOLDER)))
+	chunks = [
+		(paths[i : i + per_store], digests[i : i + per_store]) for i in range(0, len(paths), max(1, per_store))
+	]
+
+	# 每個分割各自對應一個 vector store：先查快取，未命中者才需要上傳與建立
+	store_ids: List[Optional[str]] = [None] * len(chunks)
+	chunk_hashes: List[Optional[str]] = [None] * len(chunks)
+	chunk_file_ids: List[List[str]] = [[] for _ in chunks]
+	for k, (chunk_paths, chunk_digests) in enumerate(chunks):
+		if cache is None:
+			continue
+		listing = "\n".join(f"{p.relative_to(folder).as_posix()}\t{d}" for p, d in zip(chunk_paths, chunk_digests))
+		chunk_hashes[k] = hashlib.sha256(listing.encode("utf-8")).hexdigest()
+		entry = _cached_vector_store(agents_client, cache, chunk_hashes[k])
+		if entry:
+			print(f"Reusing vector store for {folder.name}: {entry['id']}")
+			with _CACHE_LOCK:
+				entry["last_used"] = time.time()
+			store_ids[k] = entry["id"]
+			chunk_file_ids[k] = list(entry.get("file_ids", []))
+
+	pending = [k for k in range(len(chunks)) if store_ids[k] is None]
+	# 同時上傳多個檔案；map 保留輸入順序，vector store 的檔案順序維持固定
+	todo = [(k, p, d) for k in pending for p, d in zip(*chunks[k])]
+	complete = [True] * len(chunks)
+	with ThreadPoolExecutor(max_workers=max(1, UPLOAD_CONCURRENCY)) as pool:
+		for (k, _, _), fid in zip(todo, pool.map(lambda t: _upload_file(agents_client, t[1], cache, t[2]), todo)):
+			if not fid:
+				complete[k] = False
+			elif fid not in chunk_file_ids[k]:
+				# 同一分割內內容相同的檔案共用 file id，只加入一次
+				chunk_file_ids[k].append(fid)
+
+	pending = [k for k in pending if chunk_file_ids[k]]
+	if not pending and not any(store_ids):
+		raise RuntimeError(f"No files uploaded from folder: {folder}")
+
+	def _build(k: int) -> None:
+		part = f" (part {k + 1}/{len(chunks)})" if len(chunks) > 1 else ""
+		print(
+			f"Creating vector store for {folder.name}{part} with {len(chunk_file_ids[k])} files "
+			f"(expire {VECTORSTORE_EXPIRE_DAYS}d after last active)..."
+		)
+		suffix = f"_{k + 1}" if len(chunks) > 1 else ""
+		try:
+			store_ids[k] = _create_vector_store(agents_client, f"wiki_export_{folder.name}{suffix}", chunk_file_ids[k])
+		except Exception as e:
+			# 單一分割失敗時略過，其餘分割照常出題
+			print(f"Error creating vector store for {folder.name}{part}: {e}. Skipping.")
+			return
+		# 僅在該分割所有檔案皆上傳成功時記錄，避免日後沿用缺檔的 vector store
+		if chunk_hashes[k] is not None and complete[k]:
+			with _CACHE_LOCK:
+				cache["vector_stores"][chunk_hashes[k]] = {
+					"id": store_ids[k],
+					"file_ids": chunk_file_ids[k],
+					"last_used": time.time(),
+				}
+
+	# 多個 vector store 平行建立，讓各分割的匯入等待彼此重疊
+	with ThreadPoolExecutor(max_workers=max(1, min(len(pending), UPLOAD_CONCURRENCY))) as pool:
+		list(pool.map(_build, pending))
+
+	order = [k for k in range(len(chunks)) if store_ids[k]]
+	if not order:
+		raise RuntimeError(f"No vector store created for folder: {folder}")
+	return [store_ids[k] for k in order], [fid for k in order for fid in chunk_file_ids[k]]
+
+
+def _build_transport(pool_maxsize: int = HTTP_POOL_SIZE) -> RequestsTransport:
+	"""建立連線池較大的 SDK transport。
+
+	預設 transport 的連線池只有 10 條，並行上傳時會另開連線；重試交由 azure-core 的 retry policy 處理。
+	"""
+	session = requests.Session()
+	adapter = build_adapter(pool_maxsize=pool_maxsize, retries=False, pool_connections=4)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	return RequestsTransport(session=session, session_owner=True)
+
+
+def _build_credential():
+	"""建立整個行程共用的 credential（azure-identity 的 credential 為 thread-safe，並於內部快取 token）。
+
+	啟用 TOKEN_CACHE_PERSIST 時，DefaultAzureCredential 會把 cache_persistence_options 轉交給
+	其內部的 InteractiveBrowserCredential，互動式登入仍排在最後，但 token 會持久化快取。
+	"""
+	extra = {}
+	if TOKEN_CACHE_PERSIST:
+		extra["cache_persistence_options"] = TokenCachePersistenceOptions(name="testset_script")
+	return DefaultAzureCredential(exclude_interactive_browser_credential=False, **extra)
+
+
+def create_agent_with_file_search(agents_client, name: str):
+	"""建立共用的 agent；只帶 file search 工具定義，vector store 於各子資料夾的 thread 上指定。"""
+	file_search = FileSearchTool()
 	print(f"Creating agent '{name}' with model deployment '{MODEL_DEPLOYMENT_NAME}' and file search tool...")
+	extra = {"response_format": AgentsResponseFormat(type="json_object")} if QA_JSON_MODE else {}
 	agent = retryable(
 		agents_client.create_agent,
 		model=MODEL_DEPLOYMENT_NAME,
 		name=name,
 		description="Wiki-grounded QA generator",
 		tools=file_search.definitions,
-		tool_resources=file_search.resources,
+		**extra,
 		instructions=(
 			"你是一位專注於文件理解與問答資料集產生的助手。"
 			"請嚴格根據我提供的知識庫(檔案向量索引)內容，產生正確且可驗證的問答資料。"
@@ -164,21 +479,23 @@ def build_prompt(qty: int) -> str:
 		+ "\n要求：\n"
 		+ "1) 僅能根據知識庫內容作答，不可使用外部或常識補全。\n"
 		+ "2) 每組包含 query 與 ground_truth 兩個欄位。\n"
-		+ "3) 請以 JSON 陣列輸出，格式如下：\n"
-		+ "   [ {\"query\": \"問題1\", \"ground_truth\": \"答案1\"}, ... ]\n"
+		+ "3) 請以 JSON 物件輸出，問答放在 pairs 陣列中，格式如下：\n"
+		+ "   {\"pairs\": [ {\"query\": \"問題1\", \"ground_truth\": \"答案1\"}, ... ]}\n"
 		+ "4) 只輸出純 JSON，勿加入任何說明文字或 Markdown。\n"
 		+ "5) 問題多樣化、具體，答案務必能從知識庫文件中找到依據。\n"
 	)
 
 
-def run_agent_and_get_messages(agents_client, agent_id: str, prompt: str):
+def run_agent_and_get_messages(agents_client, agent_id: str, vector_store_id: str, prompt: str):
 	"""建立 thread、傳送使用者訊息、執行 agent，並回傳 thread 的訊息列表。
 
 	使用與 azure-ai-agents 1.1.0b2 相容的高階方法。
+	vector store 掛在 thread 的 tool_resources 上，同一個 agent 可同時服務多個子資料夾。
 	"""
 	# 建立新 thread
 	# 註：在此 SDK 版本中，threads 透過子用戶端建立；message 與 run 提供上層便捷方法。
-	thread = retryable(agents_client.threads.create)
+	file_search = FileSearchTool(vector_store_ids=[vector_store_id])
+	thread = retryable(agents_client.threads.create, tool_resources=file_search.resources)
 
 	# 將使用者訊息加入 thread
 	retryable(
@@ -195,23 +512,28 @@ def run_agent_and_get_messages(agents_client, agent_id: str, prompt: str):
 		agent_id=agent_id,
 	)
 
-	# 輪詢直到 run 完成
-	for _ in range(60):  # 約 2 分鐘上限（60 * 2s）
+	# 輪詢直到 run 完成：間隔由 0.5s 起指數遞增（上限 5s），短的 run 能更早被察覺完成
+	run_id = getattr(run, "id", None) or run.get("id")
+	delay = 0.5
+	deadline = time.monotonic() + RUN_TIMEOUT_SEC
+	while True:
 		run = retryable(
 			agents_client.runs.get,
 			thread_id=thread.id,
-			run_id=getattr(run, "id", None) or run.get("id"),
+			run_id=run_id,
 		)
 		status = getattr(run, "status", None) or (run.get("status") if isinstance(run, dict) else None)
-		if status in ("completed", "failed", "cancelled", "expired"):
+		if status in TERMINAL_RUN_STATUSES or time.monotonic() >= deadline:
 			break
-		time.sleep(2)
+		time.sleep(delay)
+		delay = min(delay * 1.5, 5.0)
 
-	# 以遞增排序取得訊息，確保最後取得 assistant 的回覆
+	# 由新到舊取得訊息並回傳惰性的分頁 iterator：呼叫端找到最後的 assistant 回覆即停止，不會再抓後續分頁
 	messages = retryable(
 		agents_client.messages.list,
 		thread_id=thread.id,
-		order=ListSortOrder.ASCENDING,
+		order=ListSortOrder.DESCENDING,
+		limit=5,
 	)
 	return messages
 
@@ -247,37 +569,42 @@ def extract_text_from_message_content(content: Union[str, list, dict, object]) -
 
 
 def extract_json_array(text: str) -> Optional[list]:
-	"""從文字中擷取第一個 JSON 陣列，能容忍 code fence。"""
+	"""從文字中擷取問答陣列：{"pairs": [...]} 物件或第一個 JSON 陣列，能容忍 code fence。"""
 	if not text:
 		return None
-	# 若存在 code fence，先移除
-	text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.IGNORECASE | re.MULTILINE)
-
-	# 先嘗試直接解析 JSON
+	# JSON mode 下回覆即為純 JSON 物件，直接解析
 	try:
 		data = json.loads(text)
+		if isinstance(data, dict) and isinstance(data.get("pairs"), list):
+			return data["pairs"]
 		if isinstance(data, list):
 			return data
 	except Exception:
 		pass
 
-	# 後援：尋找最外層的 [...]
+	# 後援：模型未遵守格式時（例如包上說明文字或 code fence）
+	# 若存在 code fence，先移除；沒有反引號時不必跑 regex
+	text = text.strip()
+	if "`" in text:
+		text = _CODE_FENCE_RE.sub("", text)
+
+	# 從每個 '[' 起以 raw_decode 解析，解析到合法陣列結尾即停止，無須反覆解析整段尾巴
+	decoder = json.JSONDecoder()
 	start = text.find("[")
-	end = text.rfind("]")
-	if start != -1 and end != -1 and end > start:
-		candidate = text[start : end + 1]
+	while start != -1:
 		try:
-			data = json.loads(candidate)
+			data, _ = decoder.raw_decode(text, start)
 			if isinstance(data, list):
 				return data
-		except Exception:
+		except json.JSONDecodeError:
 			pass
+		start = text.find("[", start + 1)
 	return None
 
 
 def messages_to_qa_pairs(messages) -> List[QAPair]:
 	last_assistant_text = None
-	# 走訪訊息以取得最後的 assistant 回覆
+	# 訊息由新到舊排列，遇到第一則有內容的 assistant 回覆（即最後一則）就停止
 	for m in messages:
 		try:
 			role = getattr(m, "role", None) or (m.get("role") if isinstance(m, dict) else None)
@@ -288,6 +615,7 @@ def messages_to_qa_pairs(messages) -> List[QAPair]:
 				text = extract_text_from_message_content(content)
 				if text:
 					last_assistant_text = text
+					break
 		except Exception:
 			continue
 
@@ -312,13 +640,103 @@ def messages_to_qa_pairs(messages) -> List[QAPair]:
 	return qa_pairs
 
 
-def write_jsonl(pairs: List[QAPair], out_path: Path) -> None:
-	out_path.parent.mkdir(parents=True, exist_ok=True)
-	with out_path.open("w", encoding="utf-8") as f:
-		for p in pairs:
-			f.write(json.dumps({"query": p.query, "ground_truth": p.ground_truth}, ensure_ascii=False))
-			f.write("\n")
-	print(f"Wrote {len(pairs)} items to {out_path}")
+def write_jsonl(pairs: List[QAPair], f) -> None:
+	"""將 QA pairs 以 JSONL 附加寫入已開啟的二進位檔，並立即 flush，中途中斷也不會遺失已完成的部分。"""
+	f.write(b"".join(json_dumps({"query": p.query, "ground_truth": p.ground_truth}) + b"\n" for p in pairs))
+	f.flush()
+
+
+def prepare_subfolder(agents_client, subfolder: Path, cache: Optional[dict] = None) -> List[str]:
+	"""上傳階段：上傳子資料夾的檔案並建立 vector store，回傳 vector store ids。
+
+	發生錯誤時會記錄訊息並回傳空清單，不影響其他子資料夾。
+	"""
+	print("-" * 80)
+	print(f"Processing subfolder: {subfolder}")
+	try:
+		vector_store_ids, _ = upload_files_and_create_vector_stores(agents_client, subfolder, cache)
+		return vector_store_ids
+	except Exception as e:
+		print(f"Error processing {subfolder.name}: {e}")
+		return []
+
+
+def generate_for_subfolder(
+	agents_client, agent_id: str, subfolder: Path, vector_store_ids: List[str], cache: Optional[dict] = None
+) -> List[QAPair]:
+	"""出題階段：以共用 agent 對子資料夾的 vector store 產生 QA pairs，並於結束時清理資源。
+
+	發生錯誤時會記錄訊息並回傳空清單，不影響其他子資料夾。
+	已記錄於 cache 的 vector store 會保留供下次執行沿用（由服務端依 VECTORSTORE_EXPIRE_DAYS 自動過期）。
+	"""
+	if not vector_store_ids:
+		return []
+	try:
+		# 題數平均分配給各 vector store，合計仍為 QA_PER_SUBFOLDER
+		k = len(vector_store_ids)
+		quotas = [QA_PER_SUBFOLDER // k + (1 if i < QA_PER_SUBFOLDER % k else 0) for i in range(k)]
+
+		def _generate(vs_quota: Tuple[str, int]) -> List[QAPair]:
+			# 單一分割失敗時只捨棄該分割，其餘分割的問答照常保留
+			try:
+				messages = run_agent_and_get_messages(agents_client, agent_id, vs_quota[0], build_prompt(vs_quota[1]))
+				return messages_to_qa_pairs(messages)
+			except Exception as e:
+				print(f"Error generating QA pairs for {subfolder.name} (vector store {vs_quota[0]}): {e}")
+				return []
+
+		with ThreadPoolExecutor(max_workers=k) as pool:
+			pairs = [p for part in pool.map(_generate, zip(vector_store_ids, quotas)) for p in part]
+
+		# Enforce exact count when possible
+		if len(pairs) != QA_PER_SUBFOLDER:
+			print(
+				f"Warning: expected {QA_PER_SUBFOLDER} pairs, got {len(pairs)} from {subfolder.name}. Using what was returned."
+			)
+		print(f"Collected {len(pairs)} QA pairs from {subfolder.name}.")
+		return pairs
+	except Exception as e:
+		print(f"Error processing {subfolder.name}: {e}")
+		return []
+	finally:
+		# Best-effort cleanup to manage costs；已記錄於快取者保留供下次沿用，其餘（例如上傳不完整）一律刪除
+		for vector_store_id in vector_store_ids:
+			if _is_cached_vector_store(cache, vector_store_id):
+				continue
+			try:
+				retryable(agents_client.vector_stores.delete, vector_store_id)
+				print(f"Deleted vector store: {vector_store_id}")
+			except Exception as ce2:
+				print(f"Cleanup warning (delete vector store) for {subfolder.name}: {ce2}")
+
+
+def run_pipeline(
+	agents_client, agent_id: str, subfolders: List[Path], cache: Optional[dict] = None
+) -> Iterator[List[QAPair]]:
+	"""以兩段管線處理子資料夾：上傳階段與出題階段各有一個 executor。
+
+	子資料夾 N 的 agent run 在等待回應時，子資料夾 N+1 的檔案已在上傳，兩段的等待時間彼此重疊。
+	已上傳但尚未出題完畢的子資料夾數受 slots 限制，避免上傳階段遠遠領先、堆積 vector store。
+	依子資料夾順序逐一產出各子資料夾的 QA pairs。
+	"""
+	workers = max(1, SUBFOLDER_CONCURRENCY)
+	slots = threading.Semaphore(2 * workers)
+
+	def _prepare(subfolder: Path) -> List[str]:
+		slots.acquire()
+		return prepare_subfolder(agents_client, subfolder, cache)
+
+	def _generate(subfolder: Path, prepared) -> List[QAPair]:
+		try:
+			return generate_for_subfolder(agents_client, agent_id, subfolder, prepared.result(), cache)
+		finally:
+			slots.release()
+
+	with ThreadPoolExecutor(max_workers=workers) as uploader, ThreadPoolExecutor(max_workers=workers) as generator:
+		# 兩段皆依子資料夾順序排入，出題 worker 等待的上傳工作必定已排在前面，不會互相卡住
+		futures = [generator.submit(_generate, sf, uploader.submit(_prepare, sf)) for sf in subfolders]
+		for future in futures:
+			yield future.result()
 
 
 def main():
@@ -335,10 +753,13 @@ def main():
 		)
 		sys.exit(1)
 
-	credential = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-	project_client = AIProjectClient(credential=credential, endpoint=endpoint)
+	credential = _build_credential()
+	# 先在主執行緒取得一次 token，避免多個 worker 同時冷啟動、各自走一遍 credential chain
+	credential.get_token(PROJECT_TOKEN_SCOPE)
+	project_client = AIProjectClient(credential=credential, endpoint=endpoint, transport=_build_transport())
 
-	all_pairs: List[QAPair] = []
+	total = 0
+	cache = load_cache(TESTSET_CACHE_PATH) if TESTSET_CACHE else None
 
 	with project_client:
 		agents_client = project_client.agents
@@ -347,50 +768,37 @@ def main():
 			print(f"Error: wiki-export directory not found at {WIKI_EXPORT_DIR}")
 			sys.exit(1)
 
-		for subfolder in _iter_subfolders(WIKI_EXPORT_DIR):
-			print("-" * 80)
-			print(f"Processing subfolder: {subfolder}")
-			agent = None
-			vector_store_id = None
+		subfolders = list(_iter_subfolders(WIKI_EXPORT_DIR))
+		# 所有子資料夾共用一個 agent，省去每個子資料夾各一次的建立／刪除往返
+		agent = create_agent_with_file_search(agents_client, name="QA_Generator")
+		# 每完成一個子資料夾即寫入 .partial 檔；全部完成後才以 os.replace 換成正式輸出
+		OUTPUT_JSONL.parent.mkdir(parents=True, exist_ok=True)
+		partial = OUTPUT_JSONL.with_name(OUTPUT_JSONL.name + ".partial")
+		try:
 			try:
-				vector_store_id, _ = upload_files_and_create_vector_store(agents_client, subfolder)
-				agent = create_agent_with_file_search(
-					agents_client, vector_store_id, name=f"QA_Generator_{subfolder.name}"
-				)
-
-				prompt = build_prompt(QA_PER_SUBFOLDER)
-				messages = run_agent_and_get_messages(agents_client, agent.id, prompt)
-				pairs = messages_to_qa_pairs(messages)
-
-				# Enforce exact count when possible
-				if len(pairs) != QA_PER_SUBFOLDER:
-					print(
-						f"Warning: expected {QA_PER_SUBFOLDER} pairs, got {len(pairs)} from {subfolder.name}. Using what was returned."
-					)
-				all_pairs.extend(pairs)
-				print(f"Collected {len(pairs)} QA pairs from {subfolder.name}.")
-			except Exception as e:
-				print(f"Error processing {subfolder.name}: {e}")
+				# 依子資料夾順序寫入，輸出順序與逐一處理時相同
+				with partial.open("wb") as out:
+					for pairs in run_pipeline(agents_client, agent.id, subfolders, cache):
+						write_jsonl(pairs, out)
+						total += len(pairs)
 			finally:
-				# Best-effort cleanup to manage costs
-				try:
-					if agent is not None and getattr(agent, 'id', None):
-						retryable(agents_client.delete_agent, agent.id)
-						print(f"Deleted agent: {getattr(agent, 'id', '<unknown>')}")
-				except Exception as ce:
-					print(f"Cleanup warning (delete agent) for {subfolder.name}: {ce}")
-				try:
-					if vector_store_id:
-						retryable(agents_client.vector_stores.delete, vector_store_id)
-						print(f"Deleted vector store: {vector_store_id}")
-				except Exception as ce2:
-					print(f"Cleanup warning (delete vector store) for {subfolder.name}: {ce2}")
-
-	if not all_pairs:
+				if cache is not None:
+					save_cache(TESTSET_CACHE_PATH, cache)
+		finally:
+			# Best-effort cleanup to manage costs
+			try:
+				retryable(agents_client.delete_agent, agent.id)
+				print(f"Deleted agent: {agent.id}")
+			except Exception as ce:
+				print(f"Cleanup warning (delete agent): {ce}")
+
+	if not total:
+		partial.unlink(missing_ok=True)
 		print("No QA pairs generated. Exiting without writing file.")
 		sys.exit(2)
 
-	write_jsonl(all_pairs, OUTPUT_JSONL)
+	os.replace(partial, OUTPUT_JSONL)
+	print(f"Wrote {total} items to {OUTPUT_JSONL}")
 
 
 if __name__ == "main" or __name__ == "__main__":  # allow both styles
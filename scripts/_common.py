@@ -0,0 +1,81 @@
+"""
+scripts/ 內各腳本共用的 HTTP 連線池、JSON 序列化與本機狀態檔工具。
+
+以 `python scripts/0x_*.py` 執行時 scripts/ 位於 sys.path 首位，腳本可直接 `import _common`。
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # 選用：以 Rust 實作的 JSON 編碼器，直接輸出 UTF-8 bytes
+except ImportError:
+    orjson = None
+
+
+# --- HTTP --------------------------------------------------------------------
+def build_adapter(pool_maxsize: int = 32, retries: bool = True, pool_connections: int = 16) -> HTTPAdapter:
+    """連線池 + keep-alive 的 adapter。
+
+    連線池滿載時等待閒置連線（pool_block=True），而不是另開用完即丟的連線、重做 TCP+TLS 握手。
+    retries=True 時對暫時性錯誤（429/503/504）自動重試；呼叫端自行重試時請用 retries=False，避免兩層重試相乘。
+    """
+    if retries:
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 503, 504],
+            allowed_methods=["POST", "PUT", "GET"],
+            raise_on_status=False,  # 重試用盡時回傳最後的回應，交由呼叫端判斷
+        )
+    else:
+        retry = Retry(total=0, raise_on_status=False)
+    return HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry, pool_block=True
+    )
+
+
+def build_session(pool_maxsize: int = 32, retries: bool = True) -> requests.Session:
+    """建立掛載 build_adapter() 的 requests.Session，供整個行程共用。"""
+    session = requests.Session()
+    session.mount("https://", build_adapter(pool_maxsize=pool_maxsize, retries=retries))
+    return session
+
+
+# --- JSON --------------------------------------------------------------------
+def json_dumps(obj: Any) -> bytes:
+    """序列化為緊湊格式的 UTF-8 bytes；有 orjson 時優先使用，兩者輸出的位元組相同。"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# --- Local state files -------------------------------------------------------
+def load_json_state(path: Path) -> dict:
+    """讀取 save_json_state() 寫入的狀態檔；檔案不存在、損毀或最外層不是物件時回傳空 dict。"""
+    try:
+        data = json_loads(path.read_bytes())
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_json_state(path: Path, data: dict) -> None:
+    """先寫入暫存檔再以 os.replace 取代，中途中斷也不會留下寫一半的狀態檔。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(json_dumps(data))
+    os.replace(tmp, path)
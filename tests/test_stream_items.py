@@ -0,0 +1,47 @@
+import importlib.util
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+_spec = importlib.util.spec_from_file_location(
+    "create_index_with_filter", SCRIPTS_DIR / "03_create_index_with_filter.py"
+)
+create_index = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = create_index  # dataclass 需要從 sys.modules 找到模組
+_spec.loader.exec_module(create_index)
+
+
+class StreamItemsFromJsonTest(unittest.TestCase):
+    def _stream(self, text: str, chunk_size: int) -> list:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "items.json"
+            path.write_text(text, encoding="utf-8")
+            return list(create_index._stream_items_from_json(str(path), chunk_size=chunk_size))
+
+    def test_number_split_across_chunks(self):
+        items = [{"id": "1", "score": 1.5, "big": 1e5, "neg": -2.25e-3, "n": 12345}]
+        text = json.dumps({"items": items})
+        for chunk_size in range(1, 16):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self._stream(text, chunk_size), items)
+
+    def test_split_inside_bare_float_item(self):
+        # 第一個區塊剛好結束在 "1." 或 "1e"
+        self.assertEqual(self._stream('{"items": [1.5, 2]}', chunk_size=13), [1.5, 2])
+        self.assertEqual(self._stream('{"items": [1e5, 2]}', chunk_size=13), [1e5, 2])
+
+    def test_missing_items_is_empty(self):
+        self.assertEqual(self._stream('{"other": [1, 2]}', chunk_size=4), [])
+
+    def test_non_array_items_raises(self):
+        with self.assertRaises(ValueError):
+            self._stream('{"items": {"id": 1}}', chunk_size=4)
+
+
+if __name__ == "__main__":
+    unittest.main()